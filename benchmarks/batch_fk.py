@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# Forward kinematics of the Boxy arms (urdf/boxy_description.urdf): batched NumPy FK checked
+# against PyKDL.ChainFkSolverPos_recursive, and throughput of both in configurations per second.
+# Needs PyKDL and urdf_parser_py.
+#   python benchmarks/batch_fk.py [number of configurations]
+
+import os
+import sys
+import time
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+import PyKDL as kdl
+from urdf_parser_py.urdf import Robot
+from kdl_parser import kdl_tree_from_urdf_model, joint_table
+from batch_fk import FkChain, BOXY_ARMS, compare_with_kdl
+
+URDF = os.path.join(HERE, '..', 'urdf', 'boxy_description.urdf')
+
+
+def main():
+    k = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with open(URDF) as f:
+        robot = Robot.from_xml_string(f.read())
+    tree = kdl_tree_from_urdf_model(robot)
+    table = joint_table(robot)
+    for arm in sorted(BOXY_ARMS):
+        (base, tip) = BOXY_ARMS[arm]
+        chain = tree.getChain(base, tip)
+        fk = FkChain.from_kdl(chain)
+        q = np.random.uniform(-np.pi, np.pi, (k, len(fk.joints)))
+        (position, rotation) = compare_with_kdl(chain, fk, q[:1000])
+        (t_position, t_rotation) = compare_with_kdl(chain, FkChain.from_table(table, base, tip), q[:1000])
+        print('%s arm, %d joints: max error %.2e m, %.2e (KDL chain) %.2e m, %.2e (URDF table)'
+              % (arm, len(fk.joints), position, rotation, t_position, t_rotation))
+
+        start = time.time()
+        fk.tip_poses(q)
+        numpy_rate = k / (time.time() - start)
+        start = time.time()
+        fk.link_poses(q)
+        links_rate = k / (time.time() - start)
+
+        solver = kdl.ChainFkSolverPos_recursive(chain)
+        frame = kdl.Frame()
+        joints = kdl.JntArray(len(fk.joints))
+        n = min(k, 20000)
+        start = time.time()
+        for i in range(n):
+            for j in range(len(fk.joints)):
+                joints[j] = q[i, j]
+            solver.JntToCart(joints, frame)
+        kdl_rate = n / (time.time() - start)
+        print('  tip poses %10.0f cfg/s   all links %10.0f cfg/s   PyKDL %10.0f cfg/s'
+              % (numpy_rate, links_rate, kdl_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# Startup time of the object database: YAML parsing vs. the binary cache.
+#   python benchmarks/database_startup.py [number of objects]
+# A database of N objects is generated by copying the entries of config/database.yaml
+# with new names and tags.
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import yaml
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+from object_catalog import load_database, compile_database, load_cached_catalog
+
+LOADERS = {
+    'yaml': 'ObjectCatalog().updated(load_database(path))',
+    'cache': 'load_cached_catalog(path)',
+}
+
+
+# Database of n objects: copies of the entries of 'base' with new names and tags
+def copy_database(base, n):
+    names = sorted(base)
+    db = {}
+    tag = 0
+    for i in range(n):
+        src = base[names[i % len(names)]]
+        entry = dict((k, v) for k, v in src.items() if k not in src['marker'])
+        markers = []
+        for t in src['marker']:
+            new = 'tag_%d' % tag
+            tag += 1
+            entry[new] = src[t]
+            markers.append(new)
+        entry['marker'] = markers
+        entry['id'] = i
+        db['object_%d' % i] = entry
+    return db
+
+
+def make_database(path, n):
+    base = load_database(os.path.join(HERE, '..', 'config', 'database.yaml'))
+    with open(path, 'w') as f:
+        yaml.safe_dump(copy_database(base, n), f)
+
+
+# Time one load in a fresh interpreter, so imports and caches are cold
+def cold_start(path, loader):
+    code = ('import sys, time; sys.path.insert(0, %r)\n'
+            'from object_catalog import *\n'
+            'path = %r\n'
+            'start = time.time(); c = %s; print(time.time() - start)'
+            % (os.path.join(HERE, '..', 'src'), path, LOADERS[loader]))
+    out = subprocess.check_output([sys.executable, '-c', code])
+    return float(out.decode().strip())
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeat = 5
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, 'database.yaml')
+        make_database(path, n)
+        compile_database(path)
+        assert load_cached_catalog(path) is not None
+        print('%d objects, %d kB of YAML' % (n, os.path.getsize(path) // 1024))
+        for loader in ('yaml', 'cache'):
+            times = [cold_start(path, loader) for _ in range(repeat)]
+            print('%-6s best %8.2f ms   mean %8.2f ms' % (loader, min(times) * 1000,
+                                                         sum(times) / repeat * 1000))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
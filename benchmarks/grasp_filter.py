@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+# Response time of the grasping pose collision filter, for the objects of config/database.yaml
+# placed side by side: cached answers and answers computed after the scene moved.
+#   python benchmarks/grasp_filter.py
+
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+from object_catalog import ObjectCatalog, load_database
+from grasp_filter import GraspFilter
+from mesh_io import read_stl
+
+MESHES = os.path.join(HERE, '..', 'meshes')
+
+
+def main():
+    catalog = ObjectCatalog().updated(load_database(os.path.join(HERE, '..', 'config', 'database.yaml')))[0]
+    scene = [catalog.get(name) for name in sorted(catalog.objects)]
+    poses = dict((r.name, ((0.3 * i, 0.0, 0.0), (0.0, 0.0, 0.0, 1.0))) for i, r in enumerate(scene))
+    grasp_filter = GraspFilter(read_stl(os.path.join(MESHES, 'gripper_base.stl')),
+                               read_stl(os.path.join(MESHES, 'gripper_finger.stl')))
+    repeat = 1000
+    print('%-16s %6s %12s %12s' % ('object', 'poses', 'cached us', 'computed us'))
+    for record in scene:
+        grasp_filter.rank(record, scene, poses)
+        start = time.time()
+        for _ in range(repeat):
+            grasp_filter.rank(record, scene, poses)
+        cached = (time.time() - start) / repeat
+
+        start = time.time()
+        for i in range(repeat):
+            # Moves the object a bit more than the threshold every time
+            moved = dict(poses)
+            moved[record.name] = ((0.3 * scene.index(record) + 0.003 * (i % 2), 0.0, 0.0), (0.0, 0.0, 0.0, 1.0))
+            grasp_filter.rank(record, scene, moved)
+        computed = (time.time() - start) / repeat
+        print('%-16s %6d %12.1f %12.1f' % (record.name, len(record.grasp_poses), cached * 1e6, computed * 1e6))
+
+
+if __name__ == '__main__':
+    main()
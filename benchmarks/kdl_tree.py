@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# KDL tree construction for urdf/boxy_description.urdf: former recursive builder on a parsed
+# URDF vs. the joint table (parsed or from its cache). Needs PyKDL and urdf_parser_py.
+#   python benchmarks/kdl_tree.py
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+import PyKDL as kdl
+from urdf_parser_py.urdf import Robot
+from kdl_parser import urdf_inertial_to_kdl_rbi, urdf_joint_to_kdl_joint, urdf_pose_to_kdl_frame, \
+    kdl_tree_from_urdf_xml
+
+URDF = os.path.join(HERE, '..', 'urdf', 'boxy_description.urdf')
+
+
+# Former implementation
+def recursive_tree(urdf):
+    root = urdf.get_root()
+    tree = kdl.Tree(root)
+
+    def add_children_to_tree(parent):
+        if parent in urdf.child_map:
+            for joint, child_name in urdf.child_map[parent]:
+                child = urdf.link_map[child_name]
+                if child.inertial is not None:
+                    kdl_inert = urdf_inertial_to_kdl_rbi(child.inertial)
+                else:
+                    kdl_inert = kdl.RigidBodyInertia()
+                kdl_jnt = urdf_joint_to_kdl_joint(urdf.joint_map[joint])
+                kdl_origin = urdf_pose_to_kdl_frame(urdf.joint_map[joint].origin)
+                tree.addSegment(kdl.Segment(child_name, kdl_jnt, kdl_origin, kdl_inert), parent)
+                add_children_to_tree(child_name)
+    add_children_to_tree(root)
+    return tree
+
+
+def best(function, repeat=20):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return min(times) * 1000
+
+
+def main():
+    with open(URDF) as f:
+        xml = f.read()
+    tmp = tempfile.mkdtemp()
+    try:
+        old = recursive_tree(Robot.from_xml_string(xml))
+        new = kdl_tree_from_urdf_xml(xml, tmp)
+        assert old.getNrOfSegments() == new.getNrOfSegments()
+        assert old.getNrOfJoints() == new.getNrOfJoints()
+        print('%d segments, %d joints' % (new.getNrOfSegments(), new.getNrOfJoints()))
+        print('parse + recursive build  %8.2f ms' % best(lambda: recursive_tree(Robot.from_xml_string(xml))))
+        print('parse + table build      %8.2f ms' % best(lambda: kdl_tree_from_urdf_xml(xml, os.path.join(tmp, 'x%f' % time.time()))))
+        print('cached table build       %8.2f ms' % best(lambda: kdl_tree_from_urdf_xml(xml, tmp)))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
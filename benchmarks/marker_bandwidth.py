@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# Bandwidth of visualization_marker_array: full MarkerArray every cycle (default) vs.
+# delta encoding (~delta_markers). Needs a sourced ROS workspace with iai_markers_tracking.
+#   python benchmarks/marker_bandwidth.py [objects] [seconds]
+# Objects are copies of the ones in config/database.yaml. Each cycle (5 Hz) 10 % of them move
+# 1 cm, the rest jitter by 0.2 mm and every object has a 1 % chance to appear or disappear.
+# The random generator is seeded, so results are reproducible.
+
+import os
+import sys
+import random
+from io import BytesIO
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+import rospy
+from visualization_msgs.msg import Marker, MarkerArray
+from object_catalog import ObjectCatalog, load_database
+from object_db_reader import ObjectGraspingMarker
+from marker_delta import MarkerDelta
+
+RATE = 5.0
+
+
+def object_marker(record, pose):
+    m = Marker()
+    m.header.frame_id = 'camera_optical_frame'
+    m.ns = record.name
+    m.id = record.id
+    m.type = m.MESH_RESOURCE
+    m.mesh_resource = record.mesh
+    m.mesh_use_embedded_materials = True
+    m.scale.x = m.scale.y = m.scale.z = record.scale
+    m.lifetime = rospy.Duration(1)
+    (m.pose.position.x, m.pose.position.y, m.pose.position.z) = pose
+    m.pose.orientation.w = 1.0
+    return m
+
+
+def size(markers):
+    buf = BytesIO()
+    MarkerArray(markers=markers).serialize(buf)
+    return len(buf.getvalue())
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 60.0
+    rospy.rostime.set_rostime_initialized(True)
+    rng = random.Random(0)
+
+    base = ObjectCatalog(load_database(os.path.join(HERE, '..', 'config', 'database.yaml')))
+    records = [r for name, r in sorted(base.objects.items())]
+    scene = []
+    for i in range(n):
+        record = records[i % len(records)]
+        grasps = [ObjectGraspingMarker.grasp_markers(record, k) for k in range(len(record.grasp_poses))]
+        for g in grasps:
+            for m in g:
+                m.ns = '%s_%d' % (m.ns, i)
+                m.header.frame_id = '%s_%d' % (m.header.frame_id, i)
+        scene.append({'record': record, 'id': i, 'grasps': grasps, 'visible': True,
+                      'moving': rng.random() < 0.1, 'pose': [rng.uniform(-1, 1), rng.uniform(-1, 1), 1.0]})
+
+    delta = MarkerDelta()
+    full_bytes = delta_bytes = 0
+    cycles = int(seconds * RATE)
+    for c in range(cycles):
+        markers = []
+        for obj in scene:
+            if rng.random() < 0.01:
+                obj['visible'] = not obj['visible']
+            if not obj['visible']:
+                continue
+            step = 0.01 if obj['moving'] else 0.0002
+            obj['pose'] = [x + rng.uniform(-step, step) for x in obj['pose']]
+            m = object_marker(obj['record'], obj['pose'])
+            m.ns = '%s_%d' % (m.ns, obj['id'])
+            markers.append(m)
+            for g in obj['grasps']:
+                markers.extend(g)
+        full_bytes += size(markers)
+        delta_bytes += size(delta.encode(markers, c / RATE))
+
+    print('%d objects, %d cycles at %.0f Hz' % (n, cycles, RATE))
+    print('full MarkerArray: %10.1f kB/s' % (full_bytes / seconds / 1024))
+    print('delta encoded:    %10.1f kB/s  (%.1f %% of full, %.1f kB/s saved)'
+          % (delta_bytes / seconds / 1024, 100.0 * delta_bytes / full_bytes,
+             (full_bytes - delta_bytes) / seconds / 1024))
+
+
+if __name__ == '__main__':
+    main()
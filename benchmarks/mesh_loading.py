@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# Loading of the package meshes: copying STL reader vs. memory mapped reader, and bounding
+# volumes computed from the mesh vs. read from the disk cache.
+#   python benchmarks/mesh_loading.py
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+import mesh_io
+from mesh_io import STL_RECORD, read_stl, load_mesh, bounding_volumes
+
+MESHES = os.path.join(HERE, '..', 'meshes')
+
+
+# Former reader: whole file read, then the vertices copied into a new array
+def read_stl_copy(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    count = int(np.frombuffer(data[80:84], dtype='<u4')[0])
+    return np.frombuffer(data, dtype=STL_RECORD, count=count, offset=84)['vertices'].astype(np.float64)
+
+
+def best(function, repeat=20):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return min(times) * 1000
+
+
+def main():
+    names = sorted(n for n in os.listdir(MESHES) if os.path.splitext(n)[1].lower() in ('.stl', '.dae'))
+    tmp = tempfile.mkdtemp()
+    try:
+        print('%-22s %10s %10s %12s %12s' % ('mesh', 'copy ms', 'mmap ms', 'volumes ms', 'cached ms'))
+        for name in names:
+            path = os.path.join(MESHES, name)
+            if name.lower().endswith('.stl'):
+                copy = '%10.3f' % best(lambda: read_stl_copy(path))
+                mmap = '%10.3f' % best(lambda: read_stl(path))
+            else:
+                copy = '%10s' % '-'
+                mmap = '%10.3f' % best(lambda: load_mesh(path), 3)
+
+            def cold():
+                mesh_io._volumes.clear()
+                shutil.rmtree(os.path.join(tmp, 'cache'), ignore_errors=True)
+                bounding_volumes(path, os.path.join(tmp, 'cache'))
+
+            def cached():
+                mesh_io._volumes.clear()
+                bounding_volumes(path, os.path.join(tmp, 'cache'))
+            computed = best(cold, 3)
+            print('%-22s %s %s %12.3f %12.3f' % (name, copy, mmap, computed, best(cached)))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# End to end benchmark of object_db_reader.py: tag TFs in, MarkerArray out. The node runs in
+# this process with stand-in publishers, broadcasters and parameters, so no ROS master is
+# needed (a sourced workspace with iai_markers_tracking and tf2_ros still is).
+#   python benchmarks/pipeline.py [-n 1 10 100 1000] [-c cycles] [-p name=value ...] [-o out.json]
+# Scenes of N objects are copies of the ones in config/database.yaml with new names and tags,
+# moving as in simulate_obj_detection.py (one cycle every 0.2 s of scenario time). Each
+# cycle reports the time of every stage, the bytes sent on each topic and the latency from
+# the tag stamps to the MarkerArray. Allocations (tracemalloc, Python 3) are measured on
+# separate cycles since tracing slows everything down. Results are written as JSON.
+
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import argparse
+from io import BytesIO
+import yaml
+import numpy as np
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+import rospy
+import tf2_ros
+from tf.msg import tfMessage
+from visualization_msgs.msg import MarkerArray
+from object_catalog import ObjectCatalog, load_database
+from simulate_obj_detection import database_scenario, transform, CAMERA
+from database_startup import copy_database
+
+CAMERA_FRAME = 'camera_optical_frame'
+PERIOD = 0.2
+STAGES = ('receive', 'match_objects', 'find_obj', 'publish_obj', 'assembly', 'serialize', 'publish_markers',
+          'publish_detected', 'cycle')
+
+
+def size(msg):
+    buf = BytesIO()
+    msg.serialize(buf)
+    return len(buf.getvalue())
+
+
+class Traffic(object):
+    # Bytes sent and serialization time on each topic in the current cycle, and the time of
+    # the last message of each topic
+    def __init__(self):
+        self.sizes = {}
+        self.serialize = {}
+        self.sent = {}
+
+    def add(self, topic, msg):
+        start = time.time()
+        self.sizes[topic] = self.sizes.get(topic, 0) + size(msg)
+        self.sent[topic] = time.time()
+        self.serialize[topic] = self.serialize.get(topic, 0.0) + self.sent[topic] - start
+
+    def take(self):
+        (sizes, serialize) = (self.sizes, self.serialize)
+        (self.sizes, self.serialize) = ({}, {})
+        return sizes, serialize
+
+
+class Publisher(object):
+    # rospy.Publisher stand-in, serializes what is published
+    def __init__(self, traffic, topic, data_class, *args, **kwargs):
+        self.traffic = traffic
+        self.topic = topic
+        self.data_class = data_class
+
+    def publish(self, *args):
+        msg = args[0] if len(args) == 1 and isinstance(args[0], self.data_class) else self.data_class(*args)
+        self.traffic.add(self.topic, msg)
+
+
+class Broadcaster(object):
+    # tf2_ros (Static)TransformBroadcaster stand-in, the transforms also go to the buffer of
+    # the node as the TransformListener would do
+    def __init__(self, traffic, topic, static=False):
+        self.traffic = traffic
+        self.topic = topic
+        self.static = static
+        self.buffer = None
+
+    def sendTransform(self, transforms):
+        if not isinstance(transforms, list):
+            transforms = [transforms]
+        self.traffic.add(self.topic, tfMessage(transforms))
+        if self.buffer is not None:
+            for t in transforms:
+                if self.static:
+                    self.buffer.set_transform_static(t, 'benchmark')
+                else:
+                    self.buffer.set_transform(t, 'benchmark')
+
+
+# Replaces the parts of rospy and tf2_ros that need a master. 'params' are the private
+# parameters of the node.
+def stand_ins(traffic, params):
+    values = {'/camera_info': 'camera/camera_info',
+              '~cameras': [{'info_topic': 'camera/camera_info', 'frame': CAMERA_FRAME}]}
+    values.update(('~' + k, v) for k, v in params.items())
+    broadcasters = []
+
+    def broadcaster(topic, static=False):
+        b = Broadcaster(traffic, topic, static)
+        broadcasters.append(b)
+        return b
+
+    rospy.init_node = lambda *args, **kwargs: None
+    rospy.get_param = lambda name, *default: values[name] if name in values or not default else default[0]
+    rospy.has_param = lambda name: name in values
+    rospy.Service = lambda *args, **kwargs: None
+    rospy.Subscriber = lambda *args, **kwargs: None
+    rospy.Timer = lambda *args, **kwargs: None
+    rospy.Publisher = lambda topic, data_class, *args, **kwargs: Publisher(traffic, topic, data_class)
+    rospy.rostime.set_rostime_initialized(True)
+    tf2_ros.TransformListener = lambda *args, **kwargs: None
+    tf2_ros.TransformBroadcaster = lambda: broadcaster('tf')
+    tf2_ros.StaticTransformBroadcaster = lambda: broadcaster('tf_static', True)
+    return broadcasters
+
+
+def percentiles(values, scale=1000.0):
+    if not values:
+        return {}
+    v = np.asarray(values) * scale
+    return {'mean': float(v.mean()), 'p50': float(np.percentile(v, 50)), 'p90': float(np.percentile(v, 90)),
+            'p99': float(np.percentile(v, 99)), 'max': float(v.max())}
+
+
+class Pipeline(object):
+    def __init__(self, node, traffic, scenario, buffer):
+        self.node = node
+        self.traffic = traffic
+        self.scenario = scenario
+        self.buffer = buffer
+        self.marker_pub = Publisher(traffic, 'visualization_marker_array', MarkerArray)
+        self.tags = [transform(CAMERA_FRAME, tag) for tag in scenario.tags]
+        self.quaternions = scenario.tag_q.tolist()
+        self.times = {}
+        self.cycle = 0
+        # publish_obj is timed apart from the assembly of the MarkerArray around it
+        publish_obj = node.publish_obj
+
+        def timed(obj_list):
+            start = time.time()
+            result = publish_obj(obj_list)
+            self.times['publish_obj'] = time.time() - start
+            return result
+        node.publish_obj = timed
+
+    # Tag TFs of the current cycle, as received from the detector
+    def detect(self):
+        now = rospy.Time.now()
+        p = self.scenario.positions(self.cycle * PERIOD).tolist()
+        for k, t in enumerate(self.tags):
+            t.header.stamp = now
+            (t.transform.translation.x, t.transform.translation.y, t.transform.translation.z) = p[k]
+            (t.transform.rotation.x, t.transform.rotation.y, t.transform.rotation.z,
+             t.transform.rotation.w) = self.quaternions[k]
+        self.cycle += 1
+        return now
+
+    # One cycle of the main loop of object_db_reader.py. Returns the stage times, the bytes
+    # per topic and the latency from the tag stamps to the MarkerArray.
+    def run(self):
+        node = self.node
+        times = self.times
+        stamp = self.detect()
+        start = time.time()
+        for t in self.tags:
+            self.buffer.set_transform(t, 'benchmark')
+        node.callback_tf(tfMessage(self.tags))
+        times['receive'] = time.time() - start
+
+        t0 = time.time()
+        node.apply_reload()
+        node.detections.prune(rospy.get_time())
+        matching = node.match_objects()
+        t1 = time.time()
+        obj_list = node.find_obj(matching)
+        t2 = time.time()
+        node.publish_markers(self.marker_pub, obj_list)
+        t3 = time.time()
+        node.publish_detected(obj_list)
+        t4 = time.time()
+        times.update({'match_objects': t1 - t0, 'find_obj': t2 - t1, 'publish_markers': t3 - t2,
+                      'publish_detected': t4 - t3, 'cycle': t4 - start})
+        # publish_markers = publish_obj + assembly of the MarkerArray + its serialization
+        (sizes, serialize) = self.traffic.take()
+        times['serialize'] = sum(serialize.values())
+        times['assembly'] = max(0.0, t3 - t2 - times['publish_obj'] - serialize.get('visualization_marker_array', 0.0))
+        latency = self.traffic.sent.get('visualization_marker_array', t3) - stamp.to_sec()
+        return dict(times), sizes, latency
+
+    # Bytes allocated during one cycle (peak) and still held after it
+    def allocations(self):
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        self.run()
+        (current, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak - before, current - before
+
+
+def measure(n, cycles, warmup, alloc_cycles, params):
+    from object_db_reader import ObjectGraspingMarker
+    traffic = Traffic()
+    broadcasters = stand_ins(traffic, params)
+    base = load_database(os.path.join(HERE, '..', 'config', 'database.yaml'))
+    catalog = ObjectCatalog(copy_database(base, n))
+
+    node = ObjectGraspingMarker()
+    node.catalog = catalog
+    for b in broadcasters:
+        b.buffer = node.tfBuffer
+    scenario = database_scenario(catalog, CAMERA, n, rng=np.random.RandomState(0))
+    pipeline = Pipeline(node, traffic, scenario, node.tfBuffer)
+
+    for _ in range(warmup):
+        pipeline.run()
+    traffic.sent.clear()
+    stages = dict((s, []) for s in STAGES)
+    sizes = {}
+    latency = []
+    for _ in range(cycles):
+        (times, cycle_sizes, lat) = pipeline.run()
+        for s in STAGES:
+            stages[s].append(times.get(s, 0.0))
+        for topic, b in cycle_sizes.items():
+            sizes.setdefault(topic, []).append(b)
+        latency.append(lat)
+
+    result = {'objects': n, 'tags': len(scenario.tags), 'cycles': cycles,
+              'stages_ms': dict((s, percentiles(v)) for s, v in stages.items()),
+              'bytes_per_cycle': dict((topic, float(sum(b)) / cycles) for topic, b in sizes.items()),
+              'latency_ms': percentiles(latency),
+              'cycles_per_second': cycles / max(sum(stages['cycle']), 1e-9)}
+    if tracemalloc is not None and alloc_cycles > 0:
+        alloc = [pipeline.allocations() for _ in range(alloc_cycles)]
+        result['allocations'] = {'peak_bytes': float(np.median([a[0] for a in alloc])),
+                                 'retained_bytes': float(np.median([a[1] for a in alloc]))}
+    else:
+        result['allocations'] = None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End to end benchmark of the marker pipeline')
+    parser.add_argument('-n', '--objects', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('-c', '--cycles', type=int, default=50)
+    parser.add_argument('-w', '--warmup', type=int, default=5)
+    parser.add_argument('-a', '--alloc-cycles', type=int, default=5)
+    parser.add_argument('-p', '--param', action='append', default=[],
+                        help='Private parameter of the node, name=value (YAML value)')
+    parser.add_argument('-o', '--output', help='JSON file, standard output by default')
+    args = parser.parse_args()
+    params = dict((k, yaml.safe_load(v)) for k, _, v in (p.partition('=') for p in args.param))
+
+    results = []
+    for n in args.objects:
+        results.append(measure(n, args.cycles, args.warmup, args.alloc_cycles, params))
+        r = results[-1]
+        sys.stderr.write('%5d objects  cycle %8.2f ms  latency p99 %8.2f ms  %9.1f kB/cycle\n'
+                         % (n, r['stages_ms']['cycle']['mean'], r['latency_ms']['p99'],
+                            sum(r['bytes_per_cycle'].values()) / 1024.0))
+
+    report = {'benchmark': 'pipeline', 'time': time.time(), 'python': platform.python_version(),
+              'numpy': np.__version__, 'params': params, 'results': results}
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
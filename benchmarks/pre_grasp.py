@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# Pre-grasping poses: batched pose_math.pre_grasp_positions() vs. the former per pose
+# computation of object_db_reader.py (quaternion_matrix + matmul + sign rules).
+#   python benchmarks/pre_grasp.py [number of poses]
+# Checks first that both give bit-identical results on config/database.yaml.
+
+import os
+import sys
+import math
+import timeit
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+from pose_math import pre_grasp_positions, PRE_GRASP_RULES
+from object_catalog import load_database
+
+try:
+    from tf.transformations import quaternion_matrix
+except ImportError:
+    # Copy of tf.transformations.quaternion_matrix
+    def quaternion_matrix(quaternion):
+        q = np.array(quaternion[:4], dtype=np.float64, copy=True)
+        nq = np.dot(q, q)
+        if nq < np.finfo(float).eps * 4.0:
+            return np.identity(4)
+        q *= math.sqrt(2.0 / nq)
+        q = np.outer(q, q)
+        return np.array((
+            (1.0-q[1, 1]-q[2, 2],     q[0, 1]-q[2, 3],     q[0, 2]+q[1, 3], 0.0),
+            (    q[0, 1]+q[2, 3], 1.0-q[0, 0]-q[2, 2],     q[1, 2]-q[0, 3], 0.0),
+            (    q[0, 2]-q[1, 3],     q[1, 2]+q[0, 3], 1.0-q[0, 0]-q[1, 1], 0.0),
+            (                0.0,                 0.0,                 0.0, 1.0)
+            ), dtype=np.float64)
+
+
+# Former implementation, one grasping pose at a time
+def scalar_pre_grasp(name, orien, pos):
+    (x, y, z) = pos
+    vec = np.array([0.0, 0.0, -0.08, 0.0])
+    xm, ym, zm, wm = np.matmul(quaternion_matrix(orien), vec)
+    translate = [-xm, ym, -zm]
+    x_t = translate[0] + x
+    y_t = translate[1] + y
+    z_t = translate[2] + z
+    if abs(x_t) < abs(x):
+        x_t = -translate[0] + x
+    if abs(y_t) < abs(y):
+        y_t = -translate[1] + y
+    if abs(z_t) < abs(z):
+        z_t = -translate[2] + z
+    if 'knorr' in name:
+        x_t = -translate[0] + x
+    return x_t, y_t, z_t
+
+
+def shipped_poses():
+    db = load_database(os.path.join(HERE, '..', 'config', 'database.yaml'))
+    poses = []
+    for obj in sorted(db):
+        rules = [PRE_GRASP_RULES[r] for r in db[obj].get('pre_grasp', {}).get('flip', ['away'] * 3)]
+        for g in db[obj].get('grasping_poses', []):
+            poses.append((obj + '_' + g['p_id'], g['orientation'], g['position'], rules))
+    return poses
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    poses = shipped_poses()
+    names, q, p, rules = zip(*poses)
+    batch = pre_grasp_positions(q, p, 0.08, rules)
+    scalar = np.array([scalar_pre_grasp(*args) for args in zip(names, q, p)])
+    same = batch.tobytes() == scalar.tobytes()
+    print('%d shipped grasping poses, bit-identical: %s' % (len(poses), same))
+    if not same:
+        sys.exit(1)
+
+    reps = int(math.ceil(float(n) / len(poses)))
+    names, q, p, rules = [x * reps for x in (names, q, p, rules)]
+    q, p, rules = np.array(q), np.array(p), np.array(rules)
+    runs = 20
+    t_scalar = timeit.timeit(lambda: [scalar_pre_grasp(*args) for args in zip(names, q, p)],
+                             number=runs) / runs
+    t_batch = timeit.timeit(lambda: pre_grasp_positions(q, p, 0.08, rules), number=runs) / runs
+    print('%d poses: per pose %.3f ms, batched %.3f ms (x%.0f)'
+          % (len(q), t_scalar * 1000, t_batch * 1000, t_scalar / t_batch))
+
+
+if __name__ == '__main__':
+    main()
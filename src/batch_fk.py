@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 Universitaet Bremen - Institute for Artificial Intelligence (Prof. Beetz)
+#
+# Author: Minerva Gabriela Vargas Gleason <minervavargasg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+# Forward kinematics of a kinematic chain for a batch of K joint configurations at once.
+# A chain is kept as arrays: for each segment its joint type, axis and the point the axis
+# goes through (in the segment root frame) and the frame to the segment tip, as in KDL:
+#   pose(q) = joint(q) * tip
+# Poses are (., 4, 4) homogeneous matrices.
+
+import numpy as np
+
+try:
+    import PyKDL as kdl
+except ImportError:
+    kdl = None
+
+from pose_math import quaternion_matrices, euler_to_quats
+
+FIXED, ROTATIONAL, TRANSLATIONAL = 0, 1, 2
+JOINT_TYPES = {'fixed': FIXED, 'revolute': ROTATIONAL, 'continuous': ROTATIONAL, 'prismatic': TRANSLATIONAL}
+
+# Left and right arm of Boxy (urdf/boxy_description.urdf), from the robot base
+BOXY_ARMS = {'left': ('base_link', 'left_gripper_tool_frame'),
+             'right': ('base_link', 'right_gripper_tool_frame')}
+
+
+class FkChain:
+    # 'types' (S,), 'axes' and 'points' (S, 3) and 'tips' (S, 4, 4) of the S segments,
+    # 'names' the segment names and 'joints' the names of the movable joints, 'limits'
+    # (n_joints, 2) their lower and upper limits (default one turn).
+    def __init__(self, names, joints, types, axes, points, tips, limits=None):
+        self.names = list(names)
+        self.joints = list(joints)
+        if limits is None:
+            limits = [[-np.pi, np.pi]] * len(self.joints)
+        self.limits = np.asarray(limits, dtype=np.float64).reshape(-1, 2)
+        self.types = np.asarray(types, dtype=np.int8)
+        self.axes = np.asarray(axes, dtype=np.float64).reshape(-1, 3)
+        self.points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+        self.tips = np.asarray(tips, dtype=np.float64).reshape(-1, 4, 4)
+        self.compile()
+
+    # Fixed segments folded into their neighbours, for tip_poses()
+    def compile(self):
+        self.prefix = np.eye(4)
+        self.steps = []
+        for s in range(len(self.types)):
+            if self.types[s] == FIXED:
+                if self.steps:
+                    self.steps[-1][3] = self.steps[-1][3].dot(self.tips[s])
+                else:
+                    self.prefix = self.prefix.dot(self.tips[s])
+            else:
+                self.steps.append([self.types[s], self.axes[s], self.points[s], self.tips[s].copy()])
+
+    # Chain of a PyKDL.Chain (e.g. kdl_tree_from_urdf_model(urdf).getChain(base, tip))
+    @classmethod
+    def from_kdl(cls, chain):
+        names, joints, types, axes, points, tips = [], [], [], [], [], []
+        for i in range(chain.getNrOfSegments()):
+            segment = chain.getSegment(i)
+            joint = segment.getJoint()
+            kind = joint.getType()
+            if kind in (kdl.Joint.RotAxis, kdl.Joint.RotX, kdl.Joint.RotY, kdl.Joint.RotZ):
+                types.append(ROTATIONAL)
+            elif kind in (kdl.Joint.TransAxis, kdl.Joint.TransX, kdl.Joint.TransY, kdl.Joint.TransZ):
+                types.append(TRANSLATIONAL)
+            elif kind in (getattr(kdl.Joint, 'None', None), getattr(kdl.Joint, 'Fixed', None)):
+                types.append(FIXED)
+            else:
+                raise ValueError('Unsupported joint type of segment %s' % segment.getName())
+            if types[-1] != FIXED:
+                joints.append(joint.getName())
+            names.append(segment.getName())
+            axes.append([joint.JointAxis()[k] for k in range(3)])
+            points.append([joint.JointOrigin()[k] for k in range(3)])
+            f = segment.getFrameToTip()
+            tips.append([[f.M[r, 0], f.M[r, 1], f.M[r, 2], f.p[r]] for r in range(3)] + [[0., 0., 0., 1.]])
+        return cls(names, joints, types, axes, points, tips)
+
+    # Chain from 'base' to 'tip' link of a kdl_parser.JointTable, without KDL
+    @classmethod
+    def from_table(cls, table, base, tip):
+        index = dict((child, k) for k, child in enumerate(table.child))
+        path = []
+        link = tip
+        while link != base:
+            if link not in index:
+                raise ValueError('%s is not below %s' % (tip, base))
+            path.append(index[link])
+            link = table.parent[index[link]]
+        path.reverse()
+        if not path:
+            return cls([], [], [], np.zeros((0, 3)), np.zeros((0, 3)), np.zeros((0, 4, 4)))
+        rot = quaternion_matrices(euler_to_quats(table.origin_rpy[path]))
+        tips = np.zeros((len(path), 4, 4))
+        tips[:, :3, :3] = rot
+        tips[:, :3, 3] = table.origin_xyz[path]
+        tips[:, 3, 3] = 1.0
+        types = [JOINT_TYPES.get(table.joint_type[k], FIXED) for k in path]
+        axes = np.einsum('nij,nj->ni', rot, table.axis[path])
+        axes /= np.maximum(np.linalg.norm(axes, axis=1), 1e-12)[:, None]
+        movable = [k for k, t in zip(path, types) if t != FIXED]
+        return cls([table.child[k] for k in path], [table.joint[k] for k in movable], types, axes,
+                   table.origin_xyz[path], tips, table.limits[movable])
+
+    # (K, n_joints) random joint values within the limits
+    def random_configurations(self, k, rng=np.random):
+        return rng.uniform(self.limits[:, 0], self.limits[:, 1], (k, len(self.joints)))
+
+    # (K, 4, 4) transforms of one segment's joint for the (K,) joint values q
+    @staticmethod
+    def joint_transforms(kind, axis, point, q):
+        t = np.zeros((len(q), 4, 4))
+        t[:, 3, 3] = 1.0
+        if kind == TRANSLATIONAL:
+            t[:, 0, 0] = t[:, 1, 1] = t[:, 2, 2] = 1.0
+            t[:, :3, 3] = q[:, None] * axis
+            return t
+        # Rodrigues' formula, the axis goes through 'point'
+        (c, s) = (np.cos(q), np.sin(q))
+        (x, y, z) = axis
+        outer = np.outer(axis, axis)
+        cross = np.array([[0.0, -z, y], [z, 0.0, -x], [-y, x, 0.0]])
+        r = c[:, None, None] * np.eye(3) + s[:, None, None] * cross + (1.0 - c)[:, None, None] * outer
+        t[:, :3, :3] = r
+        t[:, :3, 3] = point - r.dot(point)
+        return t
+
+    # (K, S, 4, 4) poses of every segment tip wrt. the chain base, for (K, n_joints)
+    # joint values
+    def link_poses(self, q):
+        q = np.asarray(q, dtype=np.float64).reshape(-1, len(self.joints))
+        k = len(q)
+        poses = np.empty((k, len(self.types), 4, 4))
+        current = np.broadcast_to(np.eye(4), (k, 4, 4))
+        j = 0
+        for s in range(len(self.types)):
+            if self.types[s] == FIXED:
+                current = np.matmul(current, self.tips[s])
+            else:
+                joint = self.joint_transforms(self.types[s], self.axes[s], self.points[s], q[:, j])
+                current = np.matmul(np.matmul(current, joint), self.tips[s])
+                j += 1
+            poses[:, s] = current
+        return poses
+
+    # (K, 4, 4) poses of the chain tip wrt. the chain base
+    def tip_poses(self, q):
+        q = np.asarray(q, dtype=np.float64).reshape(-1, len(self.joints))
+        current = np.broadcast_to(self.prefix, (len(q), 4, 4))
+        for j, (kind, axis, point, tip) in enumerate(self.steps):
+            current = np.matmul(np.matmul(current, self.joint_transforms(kind, axis, point, q[:, j])), tip)
+        return current
+
+
+# Largest position [m] and rotation matrix element differences between the tip poses of
+# 'fk' and PyKDL.ChainFkSolverPos_recursive on the same PyKDL.Chain, for (K, n_joints) q
+def compare_with_kdl(chain, fk, q):
+    q = np.asarray(q, dtype=np.float64).reshape(-1, len(fk.joints))
+    poses = fk.tip_poses(q)
+    solver = kdl.ChainFkSolverPos_recursive(chain)
+    frame = kdl.Frame()
+    joints = kdl.JntArray(len(fk.joints))
+    (position, rotation) = (0.0, 0.0)
+    for i in range(len(q)):
+        for j in range(len(fk.joints)):
+            joints[j] = q[i, j]
+        solver.JntToCart(joints, frame)
+        p = np.array([frame.p[r] for r in range(3)])
+        m = np.array([[frame.M[r, c] for c in range(3)] for r in range(3)])
+        position = max(position, float(np.abs(poses[i, :3, 3] - p).max()))
+        rotation = max(rotation, float(np.abs(poses[i, :3, :3] - m).max()))
+    return position, rotation
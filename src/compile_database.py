@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 Universitaet Bremen - Institute for Artificial Intelligence (Prof. Beetz)
+#
+# Author: Minerva Gabriela Vargas Gleason <minervavargasg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+# Compiles config/database.yaml into the binary cache loaded by object_db_reader.py
+#   rosrun iai_markers_tracking compile_database.py [database.yaml] [output.npz]
+
+import sys
+from object_catalog import compile_database, cache_path, DatabaseError
+
+
+def main():
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    else:
+        import rospkg
+        path = rospkg.RosPack().get_path('iai_markers_tracking') + '/config/database.yaml'
+    out = sys.argv[2] if len(sys.argv) > 2 else cache_path(path)
+    try:
+        catalog = compile_database(path, out)
+    except DatabaseError as exc:
+        print('Invalid database: %s' % exc)
+        sys.exit(1)
+    print('%d objects written to %s' % (len(catalog), out))
+
+
+if __name__ == '__main__':
+    main()
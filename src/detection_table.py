@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 Universitaet Bremen - Institute for Artificial Intelligence (Prof. Beetz)
+#
+# Author: Minerva Gabriela Vargas Gleason <minervavargasg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+import threading
+
+from pose_math import poses_moved
+
+
+class DetectionTable(object):
+    # Last time each marker was seen by each camera. A marker is visible until 'ttl' seconds
+    # after its last detection, so no periodic clearing is needed. Detections are kept per
+    # (camera, tag): poses are wrt. the camera and only compared with those of the same camera.
+    # Markers that appear or move more than the thresholds are reported by wait_changes().
+    def __init__(self, ttl=0.5, move_threshold=0.002, turn_threshold=0.01):
+        self.ttl = ttl
+        self.move_threshold = move_threshold
+        self.turn_threshold = turn_threshold
+        self.last_seen = {}  # (camera, tag) -> stamp [s]
+        self.latest = {}     # (camera, tag) -> (x, y, z, qx, qy, qz, qw) of the last detection
+        self.poses = {}      # (camera, tag) -> pose of the last reported change
+        self.tag_seen = {}   # tag name -> newest stamp of all cameras
+        self.tag_cameras = {}  # tag name -> cameras that saw it
+        self.changed = set()
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+
+    # Records a detection, False if it is not newer than the last one of the tag by the same
+    # camera (dropped)
+    def update(self, tag, stamp, pose=None, camera=None):
+        key = (camera, tag)
+        with self.lock:
+            last = self.last_seen.get(key)
+            if last is not None and stamp <= last:
+                return False
+            if last is None:
+                self.tag_cameras.setdefault(tag, set()).add(camera)
+            self.last_seen[key] = stamp
+            self.latest[key] = pose
+            if stamp > self.tag_seen.get(tag, stamp - 1.0):
+                self.tag_seen[tag] = stamp
+            if last is None or last < stamp - self.ttl or self.moved(self.poses.get(key), pose):
+                self.poses[key] = pose
+                self.changed.add(tag)
+                self.cond.notify()
+            return True
+
+    def moved(self, old, new):
+        if old is None or new is None:
+            return old is not new
+        return poses_moved(old, new, self.move_threshold, self.turn_threshold)
+
+    # Block until a marker appears or moves (or 'timeout' expires), returns the changed tags
+    def wait_changes(self, timeout):
+        with self.lock:
+            if not self.changed:
+                self.cond.wait(timeout)
+            changed = self.changed
+            self.changed = set()
+        return changed
+
+    def take_changes(self):
+        with self.lock:
+            changed = self.changed
+            self.changed = set()
+        return changed
+
+    # Tags seen by any camera during the last 'ttl' seconds before 'now'
+    def visible(self, now):
+        oldest = now - self.ttl
+        with self.lock:
+            return [tag for tag, stamp in self.tag_seen.items() if stamp >= oldest]
+
+    # Detections of 'tags' during the last 'ttl' seconds before 'now', as a list of
+    # (tag, camera, stamp, pose wrt. the camera)
+    def sightings(self, tags, now):
+        oldest = now - self.ttl
+        result = []
+        with self.lock:
+            for tag in tags:
+                for camera in self.tag_cameras.get(tag, ()):
+                    stamp = self.last_seen[(camera, tag)]
+                    if stamp >= oldest:
+                        result.append((tag, camera, stamp, self.latest[(camera, tag)]))
+        return result
+
+    # Latest poses of a tag wrt. each camera that saw it
+    def tag_poses(self, tag):
+        with self.lock:
+            poses = [self.latest[(camera, tag)] for camera in self.tag_cameras.get(tag, ())]
+        return [p for p in poses if p is not None]
+
+    # Forget detections that have been stale for a long time
+    def prune(self, now, keep=10.0):
+        oldest = now - max(keep, self.ttl)
+        with self.lock:
+            for (camera, tag) in [k for k, stamp in self.last_seen.items() if stamp < oldest]:
+                del self.last_seen[(camera, tag)]
+                self.latest.pop((camera, tag), None)
+                self.poses.pop((camera, tag), None)
+                self.tag_cameras[tag].discard(camera)
+            for tag in [t for t, stamp in self.tag_seen.items() if stamp < oldest]:
+                del self.tag_seen[tag]
+                del self.tag_cameras[tag]
+
+    def __len__(self):
+        return len(self.tag_seen)
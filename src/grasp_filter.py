@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 Universitaet Bremen - Institute for Artificial Intelligence (Prof. Beetz)
+#
+# Author: Minerva Gabriela Vargas Gleason <minervavargasg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+# Collision pre-filter of the grasping poses. The gripper (three boxes, see
+# mesh_lod.gripper_boxes) is placed at every grasping and pre-grasping pose of an object and
+# tested against the oriented bounding boxes of the collision meshes of the other detected
+# objects. At the pre-grasping pose the object itself is an obstacle too.
+
+import threading
+import numpy as np
+
+from mesh_io import bounding_volumes, MeshError
+from mesh_lod import gripper_boxes
+from pose_math import quaternion_matrices, obb_separation, poses_moved
+
+# Obstacle boxes of at most this many scenes are kept
+MAX_SCENES = 64
+
+
+class GraspFilter:
+    # 'base' and 'finger' are the triangles of the gripper meshes. Poses with a clearance
+    # under 'clearance' meters are rejected. Results are kept until an object of the scene
+    # moves more than 'move_threshold' meters or turns more than 'turn_threshold' radians.
+    def __init__(self, base, finger, clearance=0.005, move_threshold=0.002, turn_threshold=0.01):
+        self.base = base
+        self.finger = finger
+        self.clearance = clearance
+        self.move_threshold = move_threshold
+        self.turn_threshold = turn_threshold
+        self.grippers = {}  # gripper opening -> (centers, half sizes) of the gripper boxes
+        self.boxes = {}     # collision mesh URI -> (center, axes, half sizes), None without mesh
+        self.cache = {}     # object -> (record, scene records, scene poses (K, 7), result)
+        self.grasps = {}    # object -> (record, grasp_boxes() of the record)
+        self.scenes = {}    # scene records -> scene_boxes()
+        self.lock = threading.Lock()  # rank() runs in concurrent service threads
+
+    def gripper(self, opening):
+        boxes = self.grippers.get(opening)
+        if boxes is None:
+            corners = gripper_boxes(self.base, self.finger, opening)
+            boxes = ((corners[:, 0] + corners[:, 1]) / 2, (corners[:, 1] - corners[:, 0]) / 2)
+            self.grippers[opening] = boxes
+        return boxes
+
+    # Oriented box of the collision mesh of an object, in the object frame
+    def object_box(self, record):
+        uri = record.mesh_collision
+        if uri not in self.boxes:
+            try:
+                v = bounding_volumes(uri)
+                self.boxes[uri] = (v.obb_center, v.obb_axes, v.obb_extents)
+            except (MeshError, IOError, OSError, ValueError):
+                self.boxes[uri] = None
+        return self.boxes[uri]
+
+    # True if the scene (poses (K, 7) of the same records) moved since 'old' was computed
+    def moved(self, old, poses):
+        return old.shape != poses.shape or poses_moved(old, poses, self.move_threshold, self.turn_threshold)
+
+    # Grasping poses of 'record' ranked by clearance and filtered. 'scene' are the records of
+    # the detected objects (including 'record') and 'poses' their poses as (position,
+    # quaternion), all in the same frame. Returns (names, clearances, rejected names).
+    def rank(self, record, scene, poses):
+        with self.lock:
+            return self._rank(record, scene, poses)
+
+    def _rank(self, record, scene, poses):
+        scene = [r for r in scene if r.name in poses]
+        pose_array = np.array([list(poses[r.name][0]) + list(poses[r.name][1]) for r in scene])
+        cached = self.cache.get(record.name)
+        if cached is not None and cached[0] is record and cached[1] == scene and \
+                not self.moved(cached[2], pose_array):
+            return cached[3]
+        result = self.check(record, scene, pose_array)
+        self.cache[record.name] = (record, scene, pose_array, result)
+        return result
+
+    # Gripper boxes of the grasping poses of a record, in the object frame, computed once per
+    # version of the record: (k, 2, 3) grasping and pre-grasping positions, (k, 3, 3) gripper
+    # axes as rows, (b, 3) box centers in the gripper frame and (2 k b, 3) half sizes
+    def grasp_boxes(self, record):
+        cached = self.grasps.get(record.name)
+        if cached is not None and cached[0] is record:
+            return cached[1]
+        (g_centers, g_extents) = self.gripper(record.gripper_opening)
+        k = len(record.grasp_poses)
+        gp_p = np.array([[g.position, g.pre_position] for g in record.grasp_poses], dtype=np.float64)
+        gp_axes = np.swapaxes(quaternion_matrices([g.orientation for g in record.grasp_poses]), 1, 2)
+        boxes = (gp_p.reshape(k, 2, 3), gp_axes, g_centers, np.tile(g_extents, (2 * k, 1)))
+        self.grasps[record.name] = (record, boxes)
+        return boxes
+
+    # Obstacle boxes of a scene, in the frames of their objects: (indices in the scene,
+    # centers, axes as rows, half sizes)
+    def scene_boxes(self, scene):
+        key = tuple(scene)
+        boxes = self.scenes.get(key)
+        if boxes is None:
+            obstacles = [(i, self.object_box(r)) for i, r in enumerate(scene)]
+            obstacles = [(i, box) for i, box in obstacles if box is not None]
+            boxes = (np.array([i for i, box in obstacles], dtype=np.intp),
+                     np.array([box[0] for i, box in obstacles], dtype=np.float64).reshape(-1, 3),
+                     np.array([box[1] for i, box in obstacles], dtype=np.float64).reshape(-1, 3, 3),
+                     np.array([box[2] for i, box in obstacles], dtype=np.float64).reshape(-1, 3))
+            if len(self.scenes) >= MAX_SCENES:
+                self.scenes.clear()
+            self.scenes[key] = boxes
+        return boxes
+
+    def check(self, record, scene, pose_array):
+        names = list(record.grasp_names)
+        if not names or record.name not in [r.name for r in scene]:
+            return names, [float('inf')] * len(names), []
+
+        # One rotation matrix per scene object, for its obstacle box and its grasping poses
+        rot = quaternion_matrices(pose_array[:, 3:])
+        (index, o_centers, o_axes, extents) = self.scene_boxes(scene)
+        own = [r.name for r in scene].index(record.name)
+        if len(index):
+            centers = pose_array[index, :3] + np.einsum('nij,nj->ni', rot[index], o_centers)
+            axes = np.einsum('nij,nkj->nki', rot[index], o_axes)
+
+        # Gripper boxes at the grasping and pre-grasping poses: (poses, 2, boxes)
+        (gp_p, gp_axes, g_centers, g_extents) = self.grasp_boxes(record)
+        k = len(gp_p)
+        b = len(g_centers)
+        obj_rot = rot[own]
+        p = pose_array[own, :3] + gp_p.dot(obj_rot.T)
+        # Axes of the gripper (as rows) at each grasping pose, the same at the pre-grasping pose
+        axes_g = gp_axes.dot(obj_rot.T)
+        p = (p[:, :, None, :] + np.matmul(g_centers, axes_g)[:, None, :, :]).reshape(-1, 3)
+        rot_g = np.broadcast_to(axes_g[:, None, None, :, :], (k, 2, b, 3, 3)).reshape(-1, 3, 3)
+
+        if len(index):
+            gap = obb_separation(p, rot_g, g_extents, centers, axes, extents)
+            gap = gap.reshape(k, 2, b, len(index))
+            # The gripper touches the object at the grasping pose
+            gap[:, 0, :, index == own] = np.inf
+            clearance = gap.reshape(k, -1).min(axis=1)
+        else:
+            clearance = np.full(k, np.inf)
+
+        order = np.argsort(-clearance, kind='mergesort')
+        ok = [i for i in order.tolist() if clearance[i] >= self.clearance]
+        rejected = [names[i] for i in order.tolist() if clearance[i] < self.clearance]
+        return [names[i] for i in ok], [float(clearance[i]) for i in ok], rejected
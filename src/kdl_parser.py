@@ -29,18 +29,33 @@
 #
 # Author: Kelsey Hawkins
 
+import os
+import hashlib
+from collections import namedtuple
 import numpy as np
 
-import PyKDL as kdl
-from urdf_parser_py.urdf import Robot
+# PyKDL is only needed for the KDL trees, the JointTable (and its cache) works without it.
+# urdf_parser_py is imported where a URDF is parsed, cache hits do not need it.
+try:
+    import PyKDL as kdl
+except ImportError:
+    kdl = None
 
-def euler_to_quat(r, p, y):
-    sr, sp, sy = np.sin(r/2.0), np.sin(p/2.0), np.sin(y/2.0)
-    cr, cp, cy = np.cos(r/2.0), np.cos(p/2.0), np.cos(y/2.0)
-    return [sr*cp*cy - cr*sp*sy,
-            cr*sp*cy + sr*cp*sy,
-            cr*cp*sy - sr*sp*cy,
-            cr*cp*cy + sr*sp*sy]
+try:
+    import rospkg
+except ImportError:
+    rospkg = None
+
+from pose_math import euler_to_quat, euler_to_quats
+
+##
+# Joints of a URDF in breadth first order (a parent always comes before its children),
+# with the joint origins, axes, limits and the inertials of the child links as arrays.
+JointTable = namedtuple('JointTable', ['root', 'parent', 'child', 'joint', 'joint_type',
+                                       'origin_xyz', 'origin_rpy', 'axis', 'has_inertial',
+                                       'mass', 'inertial_xyz', 'inertial_rpy', 'inertia', 'limits'])
+
+TABLE_VERSION = 2
 
 def urdf_pose_to_kdl_frame(pose):
     pos = [0., 0., 0.]
@@ -54,21 +69,25 @@ def urdf_pose_to_kdl_frame(pose):
                      kdl.Vector(*pos))
 
 def urdf_joint_to_kdl_joint(jnt):
-    origin_frame = urdf_pose_to_kdl_frame(jnt.origin)
-    if jnt.joint_type == 'fixed':
-        return kdl.Joint(jnt.name, kdl.Joint.None)
-    axis = kdl.Vector(*jnt.axis)
-    if jnt.joint_type == 'revolute':
-        return kdl.Joint(jnt.name, origin_frame.p,
+    axis = jnt.axis if jnt.axis is not None else [1., 0., 0.]
+    return kdl_joint(jnt.name, jnt.joint_type, urdf_pose_to_kdl_frame(jnt.origin), axis)
+
+# KDL joint of a URDF joint whose origin is already a kdl.Frame
+def kdl_joint(name, joint_type, origin_frame, axis):
+    if joint_type == 'fixed':
+        return kdl.Joint(name, getattr(kdl.Joint, 'None'))
+    axis = kdl.Vector(*axis)
+    if joint_type == 'revolute':
+        return kdl.Joint(name, origin_frame.p,
                          origin_frame.M * axis, kdl.Joint.RotAxis)
-    if jnt.joint_type == 'continuous':
-        return kdl.Joint(jnt.name, origin_frame.p,
+    if joint_type == 'continuous':
+        return kdl.Joint(name, origin_frame.p,
                          origin_frame.M * axis, kdl.Joint.RotAxis)
-    if jnt.joint_type == 'prismatic':
-        return kdl.Joint(jnt.name, origin_frame.p,
+    if joint_type == 'prismatic':
+        return kdl.Joint(name, origin_frame.p,
                          origin_frame.M * axis, kdl.Joint.TransAxis)
-    print "Unknown joint type: %s." % jnt.joint_type
-    return kdl.Joint(jnt.name, kdl.Joint.None)
+    print("Unknown joint type: %s." % joint_type)
+    return kdl.Joint(name, getattr(kdl.Joint, 'None'))
 
 def urdf_inertial_to_kdl_rbi(i):
     origin = urdf_pose_to_kdl_frame(i.origin)
@@ -81,30 +100,144 @@ def urdf_inertial_to_kdl_rbi(i):
                                                      i.inertia.iyz))
     return origin.M * rbi
 
+def _pose_arrays(pose):
+    if pose is None:
+        return [0., 0., 0.], [0., 0., 0.]
+    return (pose.position if pose.position is not None else [0., 0., 0.],
+            pose.rotation if pose.rotation is not None else [0., 0., 0.])
+
 ##
-# Returns a PyKDL.Tree generated from a urdf_parser_py.urdf.URDF object.
-def kdl_tree_from_urdf_model(urdf):
+# Returns the JointTable of a urdf_parser_py.urdf.URDF object, walking the tree
+# breadth first without recursion.
+def joint_table(urdf):
     root = urdf.get_root()
-    tree = kdl.Tree(root)
-    def add_children_to_tree(parent):
-        if parent in urdf.child_map:
-            for joint, child_name in urdf.child_map[parent]:
-                child = urdf.link_map[child_name]
-                if child.inertial is not None:
-                    kdl_inert = urdf_inertial_to_kdl_rbi(child.inertial)
-                else:
-                    kdl_inert = kdl.RigidBodyInertia()
-                kdl_jnt = urdf_joint_to_kdl_joint(urdf.joint_map[joint])
-                kdl_origin = urdf_pose_to_kdl_frame(urdf.joint_map[joint].origin)
-                kdl_sgm = kdl.Segment(child_name, kdl_jnt,
-                                      kdl_origin, kdl_inert)
-                tree.addSegment(kdl_sgm, parent)
-                add_children_to_tree(child_name)
-    add_children_to_tree(root)
+    rows = []
+    queue = [root]
+    while queue:
+        parent = queue.pop(0)
+        for joint, child_name in urdf.child_map.get(parent, []):
+            jnt = urdf.joint_map[joint]
+            inertial = urdf.link_map[child_name].inertial
+            (xyz, rpy) = _pose_arrays(jnt.origin)
+            if inertial is not None:
+                (i_xyz, i_rpy) = _pose_arrays(inertial.origin)
+                i = inertial.inertia
+                inertia = [i.ixx, i.iyy, i.izz, i.ixy, i.ixz, i.iyz]
+                mass = inertial.mass
+            else:
+                (i_xyz, i_rpy, inertia, mass) = ([0.] * 3, [0.] * 3, [0.] * 6, 0.)
+            # Continuous joints and joints without limits: one turn
+            limit = jnt.limit if jnt.joint_type != 'continuous' else None
+            if limit is not None and limit.lower is not None and limit.upper is not None:
+                limits = [limit.lower, limit.upper]
+            else:
+                limits = [-np.pi, np.pi] if jnt.joint_type != 'prismatic' else [0., 0.]
+            rows.append((parent, child_name, jnt.name, jnt.joint_type, xyz, rpy,
+                         jnt.axis if jnt.axis is not None else [1., 0., 0.],
+                         inertial is not None, mass, i_xyz, i_rpy, inertia, limits))
+            queue.append(child_name)
+    columns = list(zip(*rows)) if rows else [[]] * 13
+    return JointTable(root, list(columns[0]), list(columns[1]), list(columns[2]), list(columns[3]),
+                      np.array(columns[4], dtype=np.float64).reshape(-1, 3),
+                      np.array(columns[5], dtype=np.float64).reshape(-1, 3),
+                      np.array(columns[6], dtype=np.float64).reshape(-1, 3),
+                      np.array(columns[7], dtype=bool),
+                      np.array(columns[8], dtype=np.float64),
+                      np.array(columns[9], dtype=np.float64).reshape(-1, 3),
+                      np.array(columns[10], dtype=np.float64).reshape(-1, 3),
+                      np.array(columns[11], dtype=np.float64).reshape(-1, 6),
+                      np.array(columns[12], dtype=np.float64).reshape(-1, 2))
+
+##
+# Returns a PyKDL.Tree generated from a JointTable. The Euler angles of all joint and
+# inertial origins are converted to quaternions in one batch and each origin frame is
+# built once.
+def kdl_tree_from_table(table):
+    tree = kdl.Tree(table.root)
+    quats = euler_to_quats(np.concatenate((table.origin_rpy, table.inertial_rpy))).tolist()
+    n = len(table.joint)
+    for k in range(n):
+        origin = kdl.Frame(kdl.Rotation.Quaternion(*quats[k]), kdl.Vector(*table.origin_xyz[k].tolist()))
+        if table.has_inertial[k]:
+            i_origin = kdl.Frame(kdl.Rotation.Quaternion(*quats[n + k]),
+                                 kdl.Vector(*table.inertial_xyz[k].tolist()))
+            inertia = table.inertia[k].tolist()
+            kdl_inert = i_origin.M * kdl.RigidBodyInertia(float(table.mass[k]), i_origin.p,
+                                                          kdl.RotationalInertia(*inertia))
+        else:
+            kdl_inert = kdl.RigidBodyInertia()
+        kdl_jnt = kdl_joint(table.joint[k], table.joint_type[k], origin, table.axis[k].tolist())
+        tree.addSegment(kdl.Segment(table.child[k], kdl_jnt, origin, kdl_inert), table.parent[k])
     return tree
 
+##
+# Returns a PyKDL.Tree generated from a urdf_parser_py.urdf.URDF object.
+def kdl_tree_from_urdf_model(urdf):
+    return kdl_tree_from_table(joint_table(urdf))
+
+##
+# On disk cache of the JointTable of URDF strings, keyed by the SHA1 of the URDF, in the
+# ROS home ($ROS_HOME, ~/.ros by default).
+def table_cache_dir():
+    if rospkg is not None:
+        home = rospkg.get_ros_home()
+    else:
+        home = os.environ.get('ROS_HOME', os.path.join(os.path.expanduser('~'), '.ros'))
+    return os.path.join(home, 'iai_markers_tracking', 'kdl_tables')
+
+def save_table(table, path):
+    arrays = dict((f, np.asarray(getattr(table, f))) for f in JointTable._fields
+                  if f not in ('root', 'parent', 'child', 'joint', 'joint_type'))
+    for f in ('parent', 'child', 'joint', 'joint_type'):
+        arrays[f] = np.array(getattr(table, f), dtype='U')
+    arrays['root'] = np.array([table.root], dtype='U')
+    arrays['version'] = np.array([TABLE_VERSION])
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.rename(tmp, path)
+
+def load_table(path):
+    data = np.load(path, allow_pickle=False)
+    if int(data['version'][0]) != TABLE_VERSION:
+        return None
+    names = dict((f, [str(v) for v in data[f].tolist()]) for f in ('parent', 'child', 'joint', 'joint_type'))
+    return JointTable(str(data['root'][0]), names['parent'], names['child'], names['joint'],
+                      names['joint_type'], data['origin_xyz'], data['origin_rpy'], data['axis'],
+                      data['has_inertial'], data['mass'], data['inertial_xyz'], data['inertial_rpy'],
+                      data['inertia'], data['limits'])
+
+##
+# Returns the JointTable of a URDF string, from the cache when this URDF was parsed before.
+def joint_table_from_xml(xml, cache_dir=None):
+    if not isinstance(xml, bytes):
+        xml = xml.encode('utf-8')
+    path = os.path.join(cache_dir or table_cache_dir(), hashlib.sha1(xml).hexdigest() + '.npz')
+    if os.path.exists(path):
+        try:
+            table = load_table(path)
+            if table is not None:
+                return table
+        except (IOError, OSError, KeyError, ValueError):
+            pass
+    from urdf_parser_py.urdf import Robot
+    table = joint_table(Robot.from_xml_string(xml))
+    try:
+        save_table(table, path)
+    except (IOError, OSError):
+        pass
+    return table
+
+##
+# Returns a PyKDL.Tree of a URDF string, the XML is only parsed on a cache miss.
+def kdl_tree_from_urdf_xml(xml, cache_dir=None):
+    return kdl_tree_from_table(joint_table_from_xml(xml, cache_dir))
+
 def main():
     import sys
+    from urdf_parser_py.urdf import Robot
     def usage():
         print("Tests for kdl_parser:\n")
         print("kdl_parser <urdf file>")
@@ -120,25 +253,23 @@ def main():
     if (len(sys.argv) == 1):
         robot = Robot.from_parameter_server()
     else:
-        f = file(sys.argv[1], 'r')
-        robot = Robot.from_xml_string(f.read())
-        f.close()
+        with open(sys.argv[1], 'r') as f:
+            robot = Robot.from_xml_string(f.read())
     tree = kdl_tree_from_urdf_model(robot)
     num_non_fixed_joints = 0
     for j in robot.joint_map:
         if robot.joint_map[j].joint_type != 'fixed':
             num_non_fixed_joints += 1
-    print "URDF non-fixed joints: %d;" % num_non_fixed_joints,
-    print "KDL joints: %d" % tree.getNrOfJoints()
-    print "URDF joints: %d; KDL segments: %d" %(len(robot.joint_map),
-                                                tree.getNrOfSegments())
+    print("URDF non-fixed joints: %d; KDL joints: %d" % (num_non_fixed_joints, tree.getNrOfJoints()))
+    print("URDF joints: %d; KDL segments: %d" % (len(robot.joint_map),
+                                                 tree.getNrOfSegments()))
     import random
     base_link = robot.get_root()
-    end_link = robot.link_map.keys()[random.randint(0, len(robot.link_map)-1)]
+    end_link = list(robot.link_map.keys())[random.randint(0, len(robot.link_map)-1)]
     chain = tree.getChain(base_link, end_link)
-    print "Root link: %s; Random end link: %s" % (base_link, end_link)
+    print("Root link: %s; Random end link: %s" % (base_link, end_link))
     for i in range(chain.getNrOfSegments()):
-        print chain.getSegment(i).getName()
+        print(chain.getSegment(i).getName())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 Universitaet Bremen - Institute for Artificial Intelligence (Prof. Beetz)
+#
+# Author: Minerva Gabriela Vargas Gleason <minervavargasg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+# Delta encoding of MarkerArrays: only markers that are new or changed are sent, markers of
+# objects that went stale are deleted. Sent markers have no lifetime and are frame locked, so
+# RViz keeps them (following their TF frame) until they are modified or deleted.
+
+import rospy
+from visualization_msgs.msg import Marker
+
+from pose_math import poses_moved
+
+
+class MarkerDelta(object):
+    # position_threshold [m] and angle_threshold [rad]: smallest change of pose that is sent
+    # refresh_period [s]: all markers are sent again after this time (e.g. for a new RViz)
+    def __init__(self, position_threshold=0.001, angle_threshold=0.005, refresh_period=5.0):
+        self.position_threshold = position_threshold
+        self.angle_threshold = angle_threshold
+        self.refresh_period = refresh_period
+        self.sent = {}  # (ns, id) -> (frame, pose, appearance) of the last version sent
+        self.last_refresh = None
+
+    @staticmethod
+    def pose_of(m):
+        p = m.pose.position
+        q = m.pose.orientation
+        return (p.x, p.y, p.z, q.x, q.y, q.z, q.w)
+
+    @staticmethod
+    def appearance_of(m):
+        return (m.type, m.mesh_resource, m.mesh_use_embedded_materials, m.scale.x, m.scale.y, m.scale.z,
+                m.color.r, m.color.g, m.color.b, m.color.a, m.text, len(m.points))
+
+    # Returns the markers to publish for 'markers'. If 'full', 'markers' holds every visible
+    # marker and the ones missing are deleted.
+    def encode(self, markers, now, full=True):
+        refresh = full and (self.last_refresh is None or now - self.last_refresh >= self.refresh_period)
+        if refresh:
+            self.last_refresh = now
+        out = []
+        current = set()
+        for m in markers:
+            if not m.header.frame_id:
+                continue
+            key = (m.ns, m.id)
+            current.add(key)
+            pose = self.pose_of(m)
+            appearance = self.appearance_of(m)
+            old = self.sent.get(key)
+            if (refresh or old is None or old[0] != m.header.frame_id or old[2] != appearance or
+                    poses_moved(old[1], pose, self.position_threshold, self.angle_threshold)):
+                m.lifetime = rospy.Duration(0)
+                m.frame_locked = True
+                out.append(m)
+                self.sent[key] = (m.header.frame_id, pose, appearance)
+        if full:
+            for key in [k for k in self.sent if k not in current]:
+                delete = Marker()
+                delete.header.frame_id = self.sent[key][0]
+                delete.header.stamp = rospy.Time.now()
+                delete.ns, delete.id = key
+                delete.action = Marker.DELETE
+                out.append(delete)
+                del self.sent[key]
+        return out
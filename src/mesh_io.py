@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 Universitaet Bremen - Institute for Artificial Intelligence (Prof. Beetz)
+#
+# Author: Minerva Gabriela Vargas Gleason <minervavargasg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+# Reading of the STL and COLLADA meshes of the database, and their bounding volumes
+# (axis aligned box, oriented box and convex hull). The bounding volumes of each mesh are
+# cached on disk, keyed by the SHA1 of the mesh file.
+#   rosrun iai_markers_tracking mesh_io.py <mesh URI or path> ...
+# prints the bounding volumes of the given meshes.
+
+import os
+import sys
+import xml.etree.ElementTree as ElementTree
+from collections import namedtuple
+import numpy as np
+
+from object_catalog import file_sha1
+from pose_math import sphere_directions
+
+try:
+    import rospkg
+except ImportError:
+    rospkg = None
+
+try:
+    from scipy.spatial import ConvexHull
+except ImportError:
+    ConvexHull = None
+
+PACKAGE = 'iai_markers_tracking'
+PACKAGE_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+STL_RECORD = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attr', '<u2')])
+
+# Bounding volumes in the units of the mesh. The oriented box has its center, its axes as
+# rows of 'obb_axes' and its half sizes along them. 'hull' are the vertices of the convex hull.
+BoundingVolumes = namedtuple('BoundingVolumes', ['aabb_min', 'aabb_max', 'obb_center', 'obb_axes',
+                                                 'obb_extents', 'hull'])
+
+VOLUMES_VERSION = 1
+# Directions used for the convex hull when scipy is not available
+HULL_DIRECTIONS = 256
+
+
+class MeshError(Exception):
+    pass
+
+
+# File path of a package://, file:// URI or plain path
+def resolve(uri):
+    if uri.startswith('file://'):
+        return uri[len('file://'):]
+    if not uri.startswith('package://'):
+        return uri
+    (package, _, rest) = uri[len('package://'):].partition('/')
+    if package == PACKAGE:
+        return os.path.join(PACKAGE_DIR, rest)
+    if rospkg is None:
+        raise MeshError('Cannot resolve %s without rospkg' % uri)
+    try:
+        return os.path.join(rospkg.RosPack().get_path(package), rest)
+    except rospkg.ResourceNotFound:
+        raise MeshError('Package of %s not found' % uri)
+
+
+# Triangles (T, 3, 3) of a binary or ASCII STL file. Binary files are memory mapped and the
+# triangles are a float32 view of the file, without copying.
+def read_stl(path):
+    size = os.path.getsize(path)
+    if size >= 84:
+        with open(path, 'rb') as f:
+            header = f.read(84)
+        count = int(np.frombuffer(header[80:84], dtype='<u4')[0])
+        if size == 84 + count * STL_RECORD.itemsize:
+            if count == 0:
+                return np.zeros((0, 3, 3), dtype=np.float32)
+            records = np.memmap(path, dtype=STL_RECORD, mode='r', offset=84, shape=(count,))
+            return records['vertices']
+    with open(path, 'rb') as f:
+        data = f.read()
+    values = [line.split()[1:] for line in data.decode('ascii', 'replace').splitlines()
+              if line.strip().startswith('vertex')]
+    return np.array(values, dtype=np.float64).reshape(-1, 3, 3)
+
+
+# Tag name without the XML namespace
+def _tag(element):
+    return element.tag.rsplit('}', 1)[-1]
+
+
+def _children(element, name):
+    return [c for c in element if _tag(c) == name]
+
+
+def _floats(text):
+    return np.array((text or '').split(), dtype=np.float64)
+
+
+# Triangles (T, 3, 3) of the <triangles> and <polylist> of a COLLADA <mesh>. Polygons are
+# split into triangle fans.
+def _mesh_triangles(mesh, ids):
+    positions = {}
+    for source in _children(mesh, 'source'):
+        array = [c for c in source if _tag(c) == 'float_array']
+        accessor = [e for e in source.iter() if _tag(e) == 'accessor']
+        if array:
+            stride = int(accessor[0].get('stride', 3)) if accessor else 3
+            positions[source.get('id')] = _floats(array[0].text).reshape(-1, stride)[:, :3]
+    for vertices in _children(mesh, 'vertices'):
+        for i in _children(vertices, 'input'):
+            if i.get('semantic') == 'POSITION':
+                positions[vertices.get('id')] = positions.get(i.get('source').lstrip('#'))
+
+    triangles = []
+    for prim in mesh:
+        kind = _tag(prim)
+        if kind not in ('triangles', 'polylist'):
+            continue
+        inputs = _children(prim, 'input')
+        stride = max([int(i.get('offset', 0)) for i in inputs] + [0]) + 1
+        vertex = [i for i in inputs if i.get('semantic') == 'VERTEX']
+        p = _children(prim, 'p')
+        if not vertex or not p:
+            continue
+        points = positions.get(vertex[0].get('source').lstrip('#'))
+        if points is None:
+            raise MeshError('Missing vertex positions in geometry %s' % ids)
+        index = _floats(p[0].text).astype(np.int64).reshape(-1, stride)[:, int(vertex[0].get('offset', 0))]
+        if kind == 'triangles':
+            faces = index.reshape(-1, 3)
+        else:
+            vcount = _floats(_children(prim, 'vcount')[0].text).astype(np.int64)
+            start = np.concatenate(([0], np.cumsum(vcount)[:-1]))
+            fans = vcount - 2
+            first = np.repeat(start, fans)
+            k = np.arange(fans.sum()) - np.repeat(np.cumsum(fans) - fans, fans)
+            faces = np.stack((index[first], index[first + k + 1], index[first + k + 2]), axis=1)
+        triangles.append(points[faces])
+    return triangles
+
+
+# Triangles (T, 3, 3) of a COLLADA file, in meters. Only the geometry is read: the meshes
+# instanced by the visual scene with their node <matrix> transforms and the unit of the file.
+# The up axis is ignored, as in rviz.
+def read_dae(path):
+    try:
+        root = ElementTree.parse(path).getroot()
+    except ElementTree.ParseError as e:
+        raise MeshError('Cannot parse %s: %s' % (path, e))
+    elements = list(root.iter())
+    unit = [e for e in elements if _tag(e) == 'unit']
+    meter = float(unit[0].get('meter', 1.0)) if unit else 1.0
+    geometries = dict((e.get('id'), e) for e in elements if _tag(e) == 'geometry')
+
+    triangles = []
+    scenes = [e for e in elements if _tag(e) == 'visual_scene']
+    stack = [(node, np.eye(4)) for scene in scenes for node in _children(scene, 'node')]
+    while stack:
+        (node, parent) = stack.pop()
+        transform = parent
+        for matrix in _children(node, 'matrix'):
+            transform = transform.dot(_floats(matrix.text).reshape(4, 4))
+        for instance in _children(node, 'instance_geometry'):
+            geometry = geometries.get(instance.get('url', '').lstrip('#'))
+            if geometry is None:
+                continue
+            for mesh in _children(geometry, 'mesh'):
+                for t in _mesh_triangles(mesh, geometry.get('id')):
+                    triangles.append(t.dot(transform[:3, :3].T) + transform[:3, 3])
+        stack.extend((child, transform) for child in _children(node, 'node'))
+    if not scenes:
+        for (name, geometry) in geometries.items():
+            for mesh in _children(geometry, 'mesh'):
+                triangles.extend(_mesh_triangles(mesh, name))
+    if not triangles:
+        return np.zeros((0, 3, 3))
+    return np.concatenate(triangles) * meter
+
+
+# Triangles of the mesh at 'uri' (package:// URI or path), STL or COLLADA
+def load_mesh(uri):
+    path = resolve(uri)
+    if not os.path.exists(path):
+        raise MeshError('Mesh %s not found' % uri)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.stl':
+        return read_stl(path)
+    if extension == '.dae':
+        return read_dae(path)
+    raise MeshError('Unsupported mesh format: %s' % uri)
+
+
+# Vertices of the convex hull of 'points'. Without scipy, the points that are the furthest
+# along a set of directions spread on the sphere, which are vertices of the hull but not all of them.
+def convex_hull(points):
+    points = np.unique(np.ascontiguousarray(points, dtype=np.float64).view(
+        np.dtype((np.void, 24)))).view(np.float64).reshape(-1, 3)
+    if len(points) <= 4:
+        return points
+    if ConvexHull is not None:
+        try:
+            return points[ConvexHull(points).vertices]
+        except Exception:  # Degenerate (flat) meshes
+            pass
+    directions = sphere_directions(HULL_DIRECTIONS)
+    return points[np.unique(np.argmax(points.dot(directions.T), axis=0))]
+
+
+def compute_volumes(triangles):
+    vertices = np.asarray(triangles, dtype=np.float64).reshape(-1, 3)
+    if not len(vertices):
+        raise MeshError('Empty mesh')
+    hull = convex_hull(vertices)
+    # Oriented box along the principal axes of the hull vertices
+    centered = hull - hull.mean(axis=0)
+    (_, _, axes) = np.linalg.svd(centered, full_matrices=False)
+    if len(axes) < 3:
+        axes = np.eye(3)
+    elif np.linalg.det(axes) < 0:
+        axes[2] = -axes[2]
+    local = hull.dot(axes.T)
+    (low, high) = (local.min(axis=0), local.max(axis=0))
+    return BoundingVolumes(vertices.min(axis=0), vertices.max(axis=0), ((low + high) / 2).dot(axes),
+                           axes, (high - low) / 2, hull)
+
+
+def volumes_cache_dir():
+    if rospkg is not None:
+        home = rospkg.get_ros_home()
+    else:
+        home = os.path.join(os.path.expanduser('~'), '.ros')
+    return os.path.join(home, PACKAGE, 'mesh_volumes')
+
+
+_volumes = {}
+
+
+# Bounding volumes of the mesh at 'uri', from memory, the disk cache or computed (and cached)
+def bounding_volumes(uri, cache_dir=None):
+    path = resolve(uri)
+    if not os.path.exists(path):
+        raise MeshError('Mesh %s not found' % uri)
+    sha1 = file_sha1(path)
+    if sha1 in _volumes:
+        return _volumes[sha1]
+    cache = os.path.join(cache_dir or volumes_cache_dir(), sha1 + '.npz')
+    volumes = None
+    if os.path.exists(cache):
+        try:
+            data = np.load(cache, allow_pickle=False)
+            if int(data['version'][0]) == VOLUMES_VERSION:
+                volumes = BoundingVolumes(*[data[f] for f in BoundingVolumes._fields])
+        except (IOError, OSError, KeyError, ValueError):
+            volumes = None
+    if volumes is None:
+        volumes = compute_volumes(load_mesh(path))
+        try:
+            if not os.path.isdir(os.path.dirname(cache)):
+                os.makedirs(os.path.dirname(cache))
+            arrays = dict(zip(BoundingVolumes._fields, volumes))
+            arrays['version'] = np.array([VOLUMES_VERSION])
+            tmp = cache + '.tmp'
+            with open(tmp, 'wb') as f:
+                np.savez(f, **arrays)
+            os.rename(tmp, cache)
+        except (IOError, OSError):
+            pass  # Read only home, the volumes are computed again next time
+    _volumes[sha1] = volumes
+    return volumes
+
+
+def main():
+    for uri in sys.argv[1:]:
+        try:
+            v = bounding_volumes(uri)
+        except MeshError as e:
+            print('%s: %s' % (uri, e))
+            continue
+        print(uri)
+        print('  AABB   min %s  max %s' % (np.round(v.aabb_min, 4), np.round(v.aabb_max, 4)))
+        print('  OBB    center %s  half sizes %s' % (np.round(v.obb_center, 4), np.round(v.obb_extents, 4)))
+        print('  hull   %d vertices' % len(v.hull))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 Universitaet Bremen - Institute for Artificial Intelligence (Prof. Beetz)
+#
+# Author: Minerva Gabriela Vargas Gleason <minervavargasg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+# Level of detail (LOD) versions of the STL meshes, made by vertex clustering: the vertices
+# of the mesh are snapped to a grid, merged, and triangles that collapse are removed.
+#   rosrun iai_markers_tracking mesh_lod.py [meshes directory]
+# writes meshes/lod/<mesh>_lod1.stl and <mesh>_lod2.stl for every STL file.
+
+import os
+import sys
+import numpy as np
+
+from mesh_io import STL_RECORD, read_stl
+
+# Grid cells along the bounding box diagonal for each level
+LOD_RESOLUTION = {1: 40, 2: 15}
+LOD_DIR = 'lod'
+PACKAGE_URI = 'package://iai_markers_tracking/meshes/'
+
+
+def write_stl(path, triangles):
+    triangles = np.asarray(triangles, dtype=np.float64)
+    records = np.zeros(len(triangles), dtype=STL_RECORD)
+    n = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    records['normal'] = n / np.maximum(np.linalg.norm(n, axis=1), 1e-12)[:, None]
+    records['vertices'] = triangles
+    with open(path, 'wb') as f:
+        f.write(b'iai_markers_tracking LOD mesh'.ljust(80, b' '))
+        f.write(np.array([len(records)], dtype='<u4').tobytes())
+        f.write(records.tobytes())
+
+
+# Decimated triangles, with 'resolution' grid cells along the bounding box diagonal
+def decimate(triangles, resolution):
+    vertices = triangles.reshape(-1, 3)
+    low = vertices.min(axis=0)
+    size = vertices.max(axis=0) - low
+    cell = max(np.linalg.norm(size) / resolution, 1e-9)
+    cells = np.floor((vertices - low) / cell).astype(np.int64)
+    dims = cells.max(axis=0) + 1
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    (unique, inverse) = np.unique(keys, return_inverse=True)
+
+    # Each cluster is replaced by the mean of its vertices
+    counts = np.bincount(inverse)
+    centers = np.stack([np.bincount(inverse, vertices[:, i]) for i in range(3)], axis=1) / counts[:, None]
+
+    faces = inverse.reshape(-1, 3)
+    keep = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+    faces = faces[keep]
+    # Remove duplicated triangles
+    ordered = np.sort(faces, axis=1).astype(np.int64)
+    n = len(unique)
+    (_, first) = np.unique((ordered[:, 0] * n + ordered[:, 1]) * n + ordered[:, 2], return_index=True)
+    return centers[faces[np.sort(first)]]
+
+
+def lod_path(path, level):
+    (directory, name) = os.path.split(path)
+    return os.path.join(directory, LOD_DIR, os.path.splitext(name)[0] + '_lod%d.stl' % level)
+
+
+# package:// URI of the LOD version of a mesh of this package, None if there is none
+def lod_resource(uri, level):
+    if level <= 0 or not uri or not uri.startswith(PACKAGE_URI) or not uri.lower().endswith('.stl'):
+        return None
+    name = os.path.splitext(uri[len(PACKAGE_URI):])[0]
+    return PACKAGE_URI + LOD_DIR + '/' + name + '_lod%d.stl' % level
+
+
+# 12 triangles of the box between corners 'low' and 'high'
+def box_triangles(low, high):
+    c = np.array([[low[0], low[1], low[2]], [high[0], low[1], low[2]], [high[0], high[1], low[2]],
+                  [low[0], high[1], low[2]], [low[0], low[1], high[2]], [high[0], low[1], high[2]],
+                  [high[0], high[1], high[2]], [low[0], high[1], high[2]]])
+    faces = [(0, 2, 1), (0, 3, 2), (4, 5, 6), (4, 6, 7), (0, 1, 5), (0, 5, 4),
+             (1, 2, 6), (1, 6, 5), (2, 3, 7), (2, 7, 6), (3, 0, 4), (3, 4, 7)]
+    return c[np.array(faces)]
+
+
+# Gripper as three boxes (base and fingers) in the grasping pose frame, with the same
+# placement as the gripper_base.stl and gripper_finger.stl markers. 'base' and 'finger' are
+# the triangles of those meshes, 'scale' the scale of their markers. Returns the (3, 2, 3)
+# lower and upper corners of the boxes.
+def gripper_boxes(base, finger, opening, scale=0.01):
+    base = np.asarray(base, dtype=np.float64).reshape(-1, 3) * scale
+    finger = np.asarray(finger, dtype=np.float64).reshape(-1, 3) * scale
+    f_low = finger.min(axis=0)
+    f_high = finger.max(axis=0)
+    finger1 = (f_low + [-opening / 2, 0.0, 0.0], f_high + [-opening / 2, 0.0, 0.0])
+    # Second finger turned 180 deg around z
+    shift = np.array([opening / 2, 0.005, 0.0])
+    finger2 = (f_high * [-1.0, -1.0, 1.0] + shift, f_low * [-1.0, -1.0, 1.0] + shift)
+    finger2 = (np.minimum(*finger2), np.maximum(*finger2))
+    return np.array([(base.min(axis=0), base.max(axis=0)), finger1, finger2])
+
+
+# Triangles of the gripper boxes, see gripper_boxes()
+def gripper_triangles(base, finger, opening, scale=0.01):
+    return np.concatenate([box_triangles(low, high) for (low, high) in gripper_boxes(base, finger, opening, scale)])
+
+
+def main():
+    if len(sys.argv) > 1:
+        directory = sys.argv[1]
+    else:
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'meshes')
+    if not os.path.isdir(os.path.join(directory, LOD_DIR)):
+        os.makedirs(os.path.join(directory, LOD_DIR))
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith('.stl'):
+            continue
+        path = os.path.join(directory, name)
+        triangles = read_stl(path).astype(np.float64)
+        counts = []
+        for level in sorted(LOD_RESOLUTION):
+            lod = decimate(triangles, LOD_RESOLUTION[level])
+            write_stl(lod_path(path, level), lod)
+            counts.append(len(lod))
+        print('%-24s %7d triangles -> %s' % (name, len(triangles), ' / '.join(str(c) for c in counts)))
+
+
+if __name__ == '__main__':
+    main()
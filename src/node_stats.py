@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 Universitaet Bremen - Institute for Artificial Intelligence (Prof. Beetz)
+#
+# Author: Minerva Gabriela Vargas Gleason <minervavargasg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+# Instrumentation of object_db_reader.py: stage timings and counters collected by the main
+# loop and the callbacks, read (and reset) periodically for the diagnostics, and a sampling
+# profiler of all the threads of the node.
+
+import sys
+import time
+import threading
+from collections import Counter
+
+
+class NullStats(object):
+    # Instrumentation disabled, every call does nothing
+    def begin(self):
+        pass
+
+    def lap(self, name):
+        pass
+
+    def end(self):
+        pass
+
+    def stage(self, name, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+
+class NodeStats(NullStats):
+    # Timings (count, total, max) of each stage and counters since the last snapshot().
+    # begin(), lap() and end() time the stages of one cycle of the main loop; stage() and
+    # count() may be called from any thread.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last = self.cycle_start = time.time()
+        self.reset()
+
+    def reset(self):
+        self.stages = {}    # stage -> [count, total seconds, max seconds]
+        self.counters = {}  # counter -> count
+        self.since = time.time()
+
+    def begin(self):
+        self.last = self.cycle_start = time.time()
+
+    # Time since the previous lap (or begin()) as stage 'name'
+    def lap(self, name):
+        now = time.time()
+        self.stage(name, now - self.last)
+        self.last = now
+
+    def end(self):
+        self.stage('cycle', time.time() - self.cycle_start)
+
+    def stage(self, name, seconds):
+        with self.lock:
+            s = self.stages.get(name)
+            if s is None:
+                self.stages[name] = [1, seconds, seconds]
+            else:
+                s[0] += 1
+                s[1] += seconds
+                s[2] = max(s[2], seconds)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    # (seconds covered, stages, counters) since the previous snapshot, which are then reset
+    def snapshot(self):
+        with self.lock:
+            result = (time.time() - self.since, self.stages, self.counters)
+            self.reset()
+        return result
+
+
+# Stack samples of all threads (but the calling one) every 'interval' seconds during
+# 'duration' seconds. Returns a Counter of stacks in the collapsed format of flamegraph.pl:
+# 'thread;file:function:line;...' from the outermost frame.
+def sample_stacks(duration, interval=0.005):
+    me = threading.current_thread().ident
+    stacks = Counter()
+    end = time.time() + duration
+    while time.time() < end:
+        names = dict((t.ident, t.name) for t in threading.enumerate())
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s:%s:%d' % (code.co_filename.rsplit('/', 1)[-1], code.co_name, frame.f_lineno))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            stacks[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+def write_stacks(stacks, path):
+    with open(path, 'w') as f:
+        for stack, n in stacks.most_common():
+            f.write('%s %d\n' % (stack, n))
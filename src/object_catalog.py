@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 Universitaet Bremen - Institute for Artificial Intelligence (Prof. Beetz)
+#
+# Author: Minerva Gabriela Vargas Gleason <minervavargasg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import hashlib
+import yaml
+import numpy as np
+from collections import namedtuple
+from pose_math import pre_grasp_positions, PRE_GRASP_RULES
+
+# Use the libyaml parser when PyYAML was built with it
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+try:
+    _STRING_TYPES = basestring  # Python 2: str and unicode
+except NameError:
+    _STRING_TYPES = str
+
+# Pose of a marker wrt. the object frame (tag -> object transform)
+MarkerOffset = namedtuple('MarkerOffset', ['tag', 'position', 'orientation'])
+
+# Grasping pose wrt. the object frame, 'name' is the frame published on /tf.
+# The pre-grasping pose has the same orientation, at 'pre_position'.
+GraspPose = namedtuple('GraspPose', ['p_id', 'name', 'position', 'orientation', 'pre_position'])
+
+# Distance between grasping and pre-grasping poses, if the object does not set one
+PRE_GRASP_DISTANCE = 0.08
+
+
+class DatabaseError(Exception):
+    pass
+
+
+def _is_number(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+
+def _is_integer(v):
+    return isinstance(v, int) and not isinstance(v, bool)
+
+
+def _is_name(v):
+    return isinstance(v, _STRING_TYPES) and len(v) > 0
+
+
+def _check_vector(name, key, v, size):
+    if not isinstance(v, (list, tuple)) or len(v) != size or not all(_is_number(x) for x in v):
+        raise DatabaseError('%s: %s must be a list of %d numbers' % (name, key, size))
+
+
+# Check that a database entry has every field the node uses
+def validate_entry(name, entry):
+    if not isinstance(entry, dict):
+        raise DatabaseError('%s: entry must be a mapping' % name)
+    if not _is_integer(entry.get('id')):
+        raise DatabaseError('%s: missing integer id' % name)
+    markers = entry.get('marker')
+    if not isinstance(markers, list) or len(markers) == 0:
+        raise DatabaseError('%s: marker must be a non empty list' % name)
+    for tag in markers:
+        if not _is_name(tag):
+            raise DatabaseError('%s: marker names must be strings, not %r' % (name, tag))
+        if not isinstance(entry.get(tag), dict):
+            raise DatabaseError('%s: no pose for marker %s' % (name, tag))
+        _check_vector(name, tag + '/position', entry[tag].get('position'), 3)
+        _check_vector(name, tag + '/orientation', entry[tag].get('orientation'), 4)
+    for key in ('scale', 'gripper_opening'):
+        if not _is_number(entry.get(key)):
+            raise DatabaseError('%s: %s must be a number' % (name, key))
+    if entry['scale'] <= 0:
+        raise DatabaseError('%s: scale must be positive' % name)
+    poses = entry.get('grasping_poses', [])
+    if not isinstance(poses, list):
+        raise DatabaseError('%s: grasping_poses must be a list' % name)
+    for n, p in enumerate(poses):
+        if not isinstance(p, dict) or 'p_id' not in p:
+            raise DatabaseError('%s: grasping pose %d has no p_id' % (name, n))
+        if not _is_name(p['p_id']):
+            raise DatabaseError('%s: p_id of grasping pose %d must be a string, not %r' % (name, n, p['p_id']))
+        _check_vector(name, p['p_id'] + '/position', p.get('position'), 3)
+        _check_vector(name, p['p_id'] + '/orientation', p.get('orientation'), 4)
+    pre_grasp = entry.get('pre_grasp', {})
+    if not isinstance(pre_grasp, dict):
+        raise DatabaseError('%s: pre_grasp must be a mapping' % name)
+    if not _is_number(pre_grasp.get('distance', PRE_GRASP_DISTANCE)):
+        raise DatabaseError('%s: pre_grasp/distance must be a number' % name)
+    flip = pre_grasp.get('flip', ['away'] * 3)
+    if not isinstance(flip, list) or len(flip) != 3 or any(r not in PRE_GRASP_RULES for r in flip):
+        raise DatabaseError('%s: pre_grasp/flip must be a list of 3 rules out of %s'
+                            % (name, sorted(PRE_GRASP_RULES)))
+
+
+# Parse the database file, returns the raw dictionary
+def load_database(path):
+    with open(path, 'r') as f:
+        db = yaml.load(f, Loader=SafeLoader)
+    if not isinstance(db, dict):
+        raise DatabaseError('%s: the database must be a mapping of objects' % path)
+    check_tags(db)
+    return db
+
+
+# A tag identifies one object, the whole database is rejected if two objects list the same tag
+def check_tags(db):
+    owner = {}
+    for name in sorted(db, key=str):
+        markers = db[name].get('marker') if isinstance(db[name], dict) else None
+        for tag in markers if isinstance(markers, list) else []:
+            if not _is_name(tag):
+                continue
+            if tag in owner and owner[tag] != name:
+                raise DatabaseError('Marker %s is used by both %s and %s' % (tag, owner[tag], name))
+            owner[tag] = name
+
+
+# Fingerprint of a database entry, used to detect modified objects
+def entry_digest(entry):
+    return hashlib.sha1(json.dumps(entry, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class ObjectRecord(object):
+    # One entry of the object database
+    __slots__ = ('name', 'id', 'markers', 'offsets', 'mesh', 'mesh_collision', 'scale',
+                 'gripper_opening', 'grasp_poses', 'grasp_names', 'digest', 'pre_grasp_distance',
+                 'pre_grasp_rules')
+
+    def __init__(self, name, entry, digest=None):
+        self.name = name
+        self.digest = digest or entry_digest(entry)
+        self.id = entry['id']
+        self.markers = list(entry['marker'])
+        self.offsets = {}
+        for tag in self.markers:
+            self.offsets[tag] = MarkerOffset(tag, tuple(entry[tag]['position']),
+                                             tuple(entry[tag]['orientation']))
+        self.mesh = entry.get('mesh')
+        self.mesh_collision = entry.get('mesh_collision')
+        self.scale = entry.get('scale', 1.0)
+        self.gripper_opening = entry.get('gripper_opening', 0.0)
+        pre_grasp = entry.get('pre_grasp') or {}
+        self.pre_grasp_distance = pre_grasp.get('distance', PRE_GRASP_DISTANCE)
+        self.pre_grasp_rules = tuple(pre_grasp.get('flip', ['away'] * 3))
+        self.grasp_poses = [GraspPose(p['p_id'], name + '_' + p['p_id'], tuple(p['position']),
+                                      tuple(p['orientation']), p.get('pre_position'))
+                            for p in entry.get('grasping_poses') or []]
+        self.grasp_names = [g.name for g in self.grasp_poses]
+
+
+# Computes the pre-grasping poses of all the grasping poses of 'records' in one batch
+def fill_pre_grasp(records):
+    todo = [(r, n) for r in records for n, g in enumerate(r.grasp_poses) if g.pre_position is None]
+    if not todo:
+        return
+    grasps = [r.grasp_poses[n] for r, n in todo]
+    pre = pre_grasp_positions([g.orientation for g in grasps], [g.position for g in grasps],
+                              [r.pre_grasp_distance for r, n in todo],
+                              [[PRE_GRASP_RULES[a] for a in r.pre_grasp_rules] for r, n in todo])
+    for (r, n), pos in zip(todo, pre.tolist()):
+        r.grasp_poses[n] = r.grasp_poses[n]._replace(pre_position=tuple(pos))
+
+
+class ObjectCatalog(object):
+    # Indexed view of the database, built once so per-cycle lookups are O(1)
+    def __init__(self, db=None):
+        self.objects = {}     # object name -> ObjectRecord
+        self.tag_index = {}   # tag name -> (object name, MarkerOffset)
+        if db:
+            for name in db:
+                self.add(ObjectRecord(name, db[name]))
+            fill_pre_grasp(self.objects.values())
+
+    def add(self, record):
+        self.objects[record.name] = record
+        for tag in record.markers:
+            self.tag_index[tag] = (record.name, record.offsets[tag])
+
+    # Returns a new catalog for 'db' that reuses the records of unchanged objects.
+    # Invalid entries keep their previous record. Returns (catalog, changed, removed, errors)
+    def updated(self, db):
+        new = ObjectCatalog()
+        changed = []
+        errors = {}
+        for name in db:
+            old = self.objects.get(name)
+            if old is not None and old.digest == entry_digest(db[name]):
+                new.add(old)
+                continue
+            try:
+                validate_entry(name, db[name])
+            except DatabaseError as exc:
+                errors[name] = str(exc)
+                if old is not None:
+                    new.add(old)
+                continue
+            new.add(ObjectRecord(name, db[name]))
+            changed.append(name)
+        removed = [name for name in self.objects if name not in db]
+        fill_pre_grasp([new.objects[name] for name in changed])
+        return new, changed, removed, errors
+
+    def object_of(self, tag):
+        entry = self.tag_index.get(tag)
+        return entry[0] if entry is not None else None
+
+    def get(self, name):
+        return self.objects.get(name)
+
+    def grasp_names(self, name):
+        record = self.objects.get(name)
+        return record.grasp_names if record is not None else []
+
+    def __contains__(self, name):
+        return name in self.objects
+
+    def __len__(self):
+        return len(self.objects)
+
+
+# Binary cache of the database. It is stored next to the YAML file and only used while
+# the SHA1 of the YAML content matches the one it was compiled from.
+CACHE_VERSION = 2
+
+
+def cache_path(path):
+    return os.path.splitext(path)[0] + '.cache.npz'
+
+
+def file_sha1(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+# Parse the database in 'path' and write its cache, returns the catalog
+def compile_database(path, out=None):
+    sha1 = file_sha1(path)
+    catalog, changed, removed, errors = ObjectCatalog().updated(load_database(path))
+    if errors:
+        raise DatabaseError('; '.join(errors.values()))
+    write_cache(catalog, sha1, out or cache_path(path))
+    return catalog
+
+
+def write_cache(catalog, sha1, out):
+    names = sorted(catalog.objects)
+    records = [catalog.objects[name] for name in names]
+    tags = [(i, r.offsets[t]) for i, r in enumerate(records) for t in r.markers]
+    grasps = [(i, g) for i, r in enumerate(records) for g in r.grasp_poses]
+    arrays = {
+        'version': np.array([CACHE_VERSION]),
+        'yaml_sha1': np.array([sha1]),
+        'obj_name': np.array(names, dtype='U'),
+        'obj_id': np.array([r.id for r in records], dtype=np.int64),
+        'obj_digest': np.array([r.digest for r in records], dtype='U'),
+        'obj_mesh': np.array([r.mesh or '' for r in records], dtype='U'),
+        'obj_mesh_collision': np.array([r.mesh_collision or '' for r in records], dtype='U'),
+        'obj_scale': np.array([r.scale for r in records], dtype=np.float64),
+        'obj_opening': np.array([r.gripper_opening for r in records], dtype=np.float64),
+        'obj_pre_distance': np.array([r.pre_grasp_distance for r in records], dtype=np.float64),
+        'obj_pre_rules': np.array([r.pre_grasp_rules for r in records], dtype='U').reshape(-1, 3),
+        'tag_obj': np.array([i for i, o in tags], dtype=np.int32),
+        'tag_name': np.array([o.tag for i, o in tags], dtype='U'),
+        'tag_pos': np.array([o.position for i, o in tags], dtype=np.float64).reshape(-1, 3),
+        'tag_rot': np.array([o.orientation for i, o in tags], dtype=np.float64).reshape(-1, 4),
+        'gp_obj': np.array([i for i, g in grasps], dtype=np.int32),
+        'gp_id': np.array([g.p_id for i, g in grasps], dtype='U'),
+        'gp_pos': np.array([g.position for i, g in grasps], dtype=np.float64).reshape(-1, 3),
+        'gp_rot': np.array([g.orientation for i, g in grasps], dtype=np.float64).reshape(-1, 4),
+        'gp_pre': np.array([g.pre_position for i, g in grasps], dtype=np.float64).reshape(-1, 3),
+    }
+    tmp = out + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.rename(tmp, out)  # Readers never see a half written cache
+
+
+# Catalog from the cache of 'path', None if there is no up to date cache
+def load_cached_catalog(path, cache=None):
+    cache = cache or cache_path(path)
+    if not os.path.exists(cache):
+        return None
+    try:
+        data = np.load(cache, allow_pickle=False)
+        if int(data['version'][0]) != CACHE_VERSION or str(data['yaml_sha1'][0]) != file_sha1(path):
+            return None
+        names = data['obj_name'].tolist()
+        entries = [{'id': int(i), 'marker': [], 'mesh': mesh or None, 'mesh_collision': coll or None,
+                    'scale': float(scale), 'gripper_opening': float(opening), 'grasping_poses': [],
+                    'pre_grasp': {'distance': float(distance), 'flip': rules}}
+                   for i, mesh, coll, scale, opening, distance, rules in
+                   zip(data['obj_id'], data['obj_mesh'].tolist(), data['obj_mesh_collision'].tolist(),
+                       data['obj_scale'], data['obj_opening'], data['obj_pre_distance'],
+                       data['obj_pre_rules'].tolist())]
+        for i, tag, pos, rot in zip(data['tag_obj'], data['tag_name'].tolist(),
+                                    data['tag_pos'].tolist(), data['tag_rot'].tolist()):
+            entries[i]['marker'].append(tag)
+            entries[i][tag] = {'position': pos, 'orientation': rot}
+        for i, p_id, pos, rot, pre in zip(data['gp_obj'], data['gp_id'].tolist(), data['gp_pos'].tolist(),
+                                          data['gp_rot'].tolist(), data['gp_pre'].tolist()):
+            entries[i]['grasping_poses'].append({'p_id': p_id, 'position': pos, 'orientation': rot,
+                                                 'pre_position': tuple(pre)})
+        digests = data['obj_digest'].tolist()
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+    catalog = ObjectCatalog()
+    for name, entry, digest in zip(names, entries, digests):
+        catalog.add(ObjectRecord(name, entry, digest))
+    return catalog
@@ -21,16 +21,33 @@ import math
 import tf2_ros
 import yaml
 import rospkg
-import copy
-from tf.transformations import quaternion_matrix, quaternion_from_euler
-from numpy import array, matmul
-from geometry_msgs.msg import TransformStamped
+import os
+import time
+import threading
+import numpy as np
+from geometry_msgs.msg import TransformStamped, Point, PoseStamped
 from tf.msg import tfMessage
 from sensor_msgs.msg import CameraInfo
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
 from visualization_msgs.msg import Marker, MarkerArray
-from iai_markers_tracking.msg import Object
-from iai_markers_tracking.srv import GetObjectInfo
-from apscheduler.schedulers.background import BackgroundScheduler
+from iai_markers_tracking.msg import Object, ObjectInfo, GraspPose, DetectedObject, DetectedObjects
+from iai_markers_tracking.srv import GetObjectInfo, GetObjectInfoResponse, GetGraspPoses, GetGraspPosesResponse, \
+    GetObjectsInfo, GetObjectsInfoResponse, DumpProfile, DumpProfileResponse, PredictObjectPoses, \
+    PredictObjectPosesResponse
+from object_catalog import ObjectCatalog, DatabaseError, load_database, load_cached_catalog, write_cache, \
+    file_sha1, cache_path
+from detection_table import DetectionTable
+from pose_math import compose, fuse_poses
+from pose_tracker import PoseTracker
+from marker_delta import MarkerDelta
+from mesh_lod import lod_resource, gripper_triangles
+from mesh_io import read_stl, resolve
+from grasp_filter import GraspFilter
+from reachability import ReachabilityMap
+from node_stats import NullStats, NodeStats, sample_stacks, write_stacks
+
+GRIPPER_BASE_MESH = 'package://iai_markers_tracking/meshes/gripper_base.stl'
+GRIPPER_FINGER_MESH = 'package://iai_markers_tracking/meshes/gripper_finger.stl'
 
 
 class ObjectGraspingMarker:
@@ -38,186 +55,531 @@ class ObjectGraspingMarker:
 
     def __init__(self):
         # Variable initialization
-        self.frame_st = {'map'}
-        self.yaml_file = {}
+        self.catalog = ObjectCatalog()
+        self.pending_catalog = None
+        self.db_path = None
+        self.db_mtime = None
+        self.db_lock = threading.Lock()
+        self.db_metrics = {'reloads': 0, 'errors': 0, 'parse_time': 0.0, 'reload_latency': 0.0}
         self.grasp_poses = {}
         self.matching = []
+        self.visible_objects = []  # Objects of the visible markers, see find_obj()
+        self.static_objects = {}  # object name -> ObjectRecord of its published static TFs
+        self.static_tfs = {}      # child frame -> TransformStamped sent on /tf_static
+        self.marker_cache = {}    # (object, grasping pose) -> (ObjectRecord, base, finger1, finger2)
+        self.delta = None
+        self.gripper_meshes = None  # Triangles of the gripper meshes, for primitive grasp markers
+        self.stats = NullStats()    # Instrumentation, see ~diagnostics
 
         rospy.init_node('object_db', anonymous=True)
+        self.detections = DetectionTable(rospy.get_param('~detection_ttl', 0.5),
+                                         rospy.get_param('~move_threshold', 0.002),
+                                         rospy.get_param('~turn_threshold', 0.01))
         self.s = rospy.Service('get_object_info', GetObjectInfo, self.list_grasping_poses)
+        self.lod_mode = rospy.get_param('~lod', 'off')
+        self.lod_thresholds = rospy.get_param('~lod_thresholds', [1.5, 3.0] if self.lod_mode == 'distance'
+                                              else [10, 30])
+        gripper = (read_stl(resolve(GRIPPER_BASE_MESH)), read_stl(resolve(GRIPPER_FINGER_MESH)))
+        if rospy.get_param('~gripper_markers', 'mesh') == 'primitive':
+            self.gripper_meshes = gripper
+        self.object_poses = {}  # object -> (position, quaternion, stamp, frame), last published
+        self.grasp_msgs = {}    # object -> (ObjectRecord, GraspPose messages)
+        self.grasp_filter = GraspFilter(gripper[0], gripper[1], rospy.get_param('~grasp_clearance', 0.005),
+                                        rospy.get_param('~move_threshold', 0.002),
+                                        rospy.get_param('~turn_threshold', 0.01))
+        self.s_filter = rospy.Service('get_grasp_poses', GetGraspPoses, self.filter_grasping_poses)
+        self.s_info = rospy.Service('get_objects_info', GetObjectsInfo, self.objects_info)
+        self.reach_map = None
+        self.reachable = {}  # object -> (record, reachability of each grasping pose of the record)
+        self.reach_filter = rospy.get_param('~reachability_filter', False)
+        reach_path = rospy.get_param('~reachability_map', '')
+        if reach_path:
+            try:
+                self.reach_map = ReachabilityMap(os.path.expanduser(reach_path),
+                                                 rospy.get_param('~reachability_tolerance', 0.5))
+            except (IOError, OSError, ValueError, KeyError) as exc:
+                rospy.logerr('Reachability map %s not loaded: %s' % (reach_path, exc))
+        if rospy.get_param('~delta_markers', False):
+            self.delta = MarkerDelta(rospy.get_param('~delta_position_threshold', 0.001),
+                                     rospy.get_param('~delta_angle_threshold', 0.005),
+                                     rospy.get_param('~delta_refresh_period', 5.0))
+        self.direct_pose = rospy.get_param('~direct_pose', True)
+        self.fusion_distance = rospy.get_param('~fusion_max_distance', 0.03)
+        self.fusion_angle = rospy.get_param('~fusion_max_angle', 0.35)
+        self.object_tags = {}  # object -> markers used for its last pose
+        self.filter_poses = rospy.get_param('~filter_poses', False)
+        self.tracker = PoseTracker(rospy.get_param('~filter_accel_noise', 0.5),
+                                   rospy.get_param('~filter_meas_noise', 0.005),
+                                   rospy.get_param('~filter_rot_gain', 0.3),
+                                   rospy.get_param('~filter_max_gap', 1.0))
+        self.tracker_lock = threading.Lock()  # The tracker is read by the predict_object_poses service
+        self.s_predict = rospy.Service('predict_object_poses', PredictObjectPoses, self.predict_object_poses)
         self.tfBuffer = tf2_ros.Buffer()
         tf2_ros.TransformListener(self.tfBuffer)
         self.tf_lis = rospy.Subscriber("tf", tfMessage, self.callback_tf)
-        camera_info_topic = rospy.get_param('/camera_info')
 
-        self.camera_lis = rospy.Subscriber(camera_info_topic, CameraInfo, self.callback_camera)
+        # Cameras: list of {info_topic: <CameraInfo topic>, frame: <optional, frame of the images>}
+        if rospy.has_param('~cameras'):
+            self.cameras = rospy.get_param('~cameras')
+        else:
+            self.cameras = [{'info_topic': rospy.get_param('/camera_info')}]
+        self.camera_frames = [cam.get('frame') for cam in self.cameras]
+        self.camera_frame = self.camera_frames[0]
+        self.camera_stats = {}  # camera frame -> [detections, mean latency, max latency]
+        self.camera_lock = threading.Lock()  # camera_stats is read by the diagnostics timer
+        self.camera_lis = [rospy.Subscriber(cam['info_topic'], CameraInfo, self.callback_camera, n)
+                           for n, cam in enumerate(self.cameras)]
+        # Objects are published wrt. this frame, the frame of the first camera if not set
+        self.common_frame = rospy.get_param('~common_frame', None)
         self.object_pub = rospy.Publisher('found_objects', Object, queue_size=20)
+        self.detected_pub = rospy.Publisher('detected_objects', DetectedObjects, queue_size=5)
+        self.on_change = rospy.get_param('~objects_on_change', False)
+        self.objects_keepalive = rospy.get_param('~objects_keepalive', 1.0)
+        self.last_found = (None, 0.0)     # (found_objects list, time) last published
+        self.last_detected = (None, 0.0)  # (object -> (pose, tags), time) last published
         self.br = tf2_ros.TransformBroadcaster()
         self.s_br = tf2_ros.StaticTransformBroadcaster()
 
+        # Stage timings and counters of the main loop and callbacks on /diagnostics
+        if rospy.get_param('~diagnostics', False):
+            self.stats = NodeStats()
+            self.cycle_budget = rospy.get_param('~diagnostics_cycle_budget', 0.2)
+            self.diag_pub = rospy.Publisher('/diagnostics', DiagnosticArray, queue_size=1)
+            self.diag_timer = rospy.Timer(rospy.Duration(rospy.get_param('~diagnostics_period', 1.0)),
+                                          self.publish_diagnostics)
+            self.s_profile = rospy.Service('dump_profile', DumpProfile, self.dump_profile)
+
     def callback_tf(self, data):
-        # Get the list of frames published by tf
-        str_data = data.transforms[0].child_frame_id
-        self.frame_st.update({str_data})
+        # Record every marker frame published in the message
+        now = rospy.get_time()
+        (tags, dropped, stale, newest) = (0, 0, 0, 0.0)
+        for t in data.transforms:
+            if 'tag_' in t.child_frame_id:
+                stamp = t.header.stamp.to_sec()
+                if stamp == 0.0:
+                    stamp = now
+                p = t.transform.translation
+                q = t.transform.rotation
+                if not self.detections.update(t.child_frame_id, stamp, (p.x, p.y, p.z, q.x, q.y, q.z, q.w),
+                                              t.header.frame_id):
+                    dropped += 1
+                elif now - stamp > self.detections.ttl:
+                    stale += 1
+                self.record_latency(t.header.frame_id, now - stamp)
+                tags += 1
+                newest = max(newest, stamp)
+        if tags:
+            # Lag: from the newest marker stamp of the message until it is processed
+            self.stats.count('detections', tags)
+            self.stats.count('dropped_tags', dropped)
+            self.stats.count('stale_tags', stale)
+            self.stats.stage('queue_lag', now - newest)
 
-    def callback_camera(self, data):
-        # Obtains the name of the camera frame
-        self.camera_frame = data.header.frame_id
+    # Number of detections and latency (from the marker stamp until it is received) per camera
+    def record_latency(self, camera, latency):
+        with self.camera_lock:
+            stats = self.camera_stats.get(camera)
+            if stats is None:
+                self.camera_stats[camera] = [1, latency, latency]
+            else:
+                stats[0] += 1
+                stats[1] += 0.05 * (latency - stats[1])
+                stats[2] = max(stats[2], latency)
 
-    def clear_v(self):
-        self.frame_st = {}
-        self.frame_st = {'map'}
+    def callback_camera(self, data, n):
+        # Obtains the name of the camera frame
+        if self.cameras[n].get('frame') is None:
+            self.camera_frames[n] = data.header.frame_id
+            self.camera_frame = self.camera_frames[0]
 
-    @staticmethod
-    def vector_rotation(q, v):
-        m = quaternion_matrix(q)
-        x,y,z, w = matmul(m, v)
-        return [-x,y,-z]
+    # Frame of the published objects
+    @property
+    def frame(self):
+        return self.common_frame or self.camera_frame
 
-    # Read all frames published in /tf and finds markers
+    # Markers published in /tf that have not gone stale
     def match_objects(self):
-        old = self.matching
-        match = [s for s in self.frame_st.copy() if "tag_" in s]
-        if len(match) > 0:
-            self.matching = match
-        else:
-            self.matching = old
+        self.matching = self.detections.visible(rospy.get_time())
         return self.matching
 
     # Open database YAML file
     def op_file(self):
         rospack = rospkg.RosPack()
-        dir = rospack.get_path('iai_markers_tracking') + '/config/database.yaml'
-        with open(dir, 'r') as f:
+        default = rospack.get_path('iai_markers_tracking') + '/config/database.yaml'
+        self.db_path = rospy.get_param('~database', default)
+        self.use_cache = rospy.get_param('~database_cache', True)
+
+        # Binary cache of the database, only used if it matches the YAML file
+        catalog = load_cached_catalog(self.db_path) if self.use_cache else None
+        if catalog is not None:
+            self.catalog = catalog
+            self.db_mtime = os.path.getmtime(self.db_path)
+            rospy.loginfo('Object database: %d objects, loaded from %s'
+                          % (len(catalog), cache_path(self.db_path)))
+        else:
+            self.reload_database()
+            self.apply_reload()
+
+        # Watch the file and re-read it when it changes
+        if rospy.get_param('~watch_database', False):
+            period = rospy.get_param('~watch_period', 1.0)
+            self.db_timer = rospy.Timer(rospy.Duration(period), self.check_database)
+
+    # Timer callback (own thread), reloads the database if the file was modified
+    def check_database(self, event):
+        try:
+            mtime = os.path.getmtime(self.db_path)
+        except OSError as exc:
+            rospy.logwarn_throttle(10, 'Cannot stat object database: %s' % exc)
+            return
+        if mtime != self.db_mtime:
+            self.reload_database()
+
+    # Parse and validate the database, the new catalog is swapped in by apply_reload()
+    def reload_database(self):
+        try:
+            mtime = os.path.getmtime(self.db_path)
+        except OSError as exc:
+            self.db_metrics['errors'] += 1
+            rospy.logerr('Object database not loaded: %s' % exc)
+            return
+        # Also when the file is invalid, so it is not read again until it changes
+        with self.db_lock:
+            self.db_mtime = mtime
+        try:
+            sha1 = file_sha1(self.db_path)
+            start = time.time()
+            db = load_database(self.db_path)
+            parse_time = time.time() - start
+        except (IOError, OSError, yaml.YAMLError, DatabaseError) as exc:
+            self.db_metrics['errors'] += 1
+            rospy.logerr('Object database not loaded: %s' % exc)
+            return
+
+        with self.db_lock:
+            current = self.pending_catalog if self.pending_catalog is not None else self.catalog
+            (catalog, changed, removed, errors) = current.updated(db)
+            for name in errors:
+                self.db_metrics['errors'] += 1
+                rospy.logerr('Invalid database entry, keeping previous version. %s' % errors[name])
+            if changed or removed:
+                self.pending_catalog = catalog
+            self.db_metrics['parse_time'] = parse_time
+            rospy.loginfo('Object database: %d objects, changed: %s, removed: %s (parse %.1f ms)'
+                          % (len(catalog), changed, removed, parse_time * 1000))
+
+        if self.use_cache and not errors:
             try:
-                db_file = f.read()
-                self.yaml_file = yaml.load(db_file)  # Creates a dictionary
-            except yaml.YAMLError as exc:
-                print(exc)
+                write_cache(catalog, sha1, cache_path(self.db_path))
+            except (IOError, OSError) as exc:
+                rospy.logdebug('Database cache not written: %s' % exc)
+
+    # Swap in a reloaded catalog, called between cycles of the main loop
+    def apply_reload(self):
+        if self.pending_catalog is not None:
+            with self.db_lock:
+                reload = len(self.catalog) > 0
+                self.catalog = self.pending_catalog
+                self.pending_catalog = None
+                self.marker_cache.clear()
+                for obj in list(self.grasp_poses):
+                    if obj in self.catalog:
+                        self.grasp_poses[obj] = self.catalog.grasp_names(obj)
+                    else:
+                        del self.grasp_poses[obj]
+                if reload:
+                    # Time from the file modification until the new version is in use
+                    self.db_metrics['reloads'] += 1
+                    self.db_metrics['reload_latency'] = time.time() - self.db_mtime
 
     # Find objects corresponding to perceived markers (match database and markers)
     def find_obj(self, matching):
         obj_list = []
         for mark in matching:
-            for y in self.yaml_file.keys():
-                a = self.yaml_file[y]['marker']
-                for n in a:
-                    if n == mark:
-                        obj_list.append(y)
-        self.object_pub.publish(obj_list)
+            obj = self.catalog.object_of(mark)
+            if obj is not None and obj not in obj_list:
+                obj_list.append(obj)
+        self.visible_objects = obj_list
+        now = rospy.get_time()
+        if not self.on_change or obj_list != self.last_found[0] or \
+                now - self.last_found[1] >= self.objects_keepalive:
+            self.object_pub.publish(obj_list)
+            self.last_found = (obj_list, now)
         return obj_list
 
+    # Transform from the first visible marker of an object to the object frame
+    def object_frame(self, obj, now):
+        record = self.catalog.get(obj)
+        if record is None:
+            return None
+        matching = set(self.matching)
+        for mar in record.markers:
+            if mar in matching:  # if marker in object = marker found
+                offset = record.offsets[mar]
+                rot_marker = offset.orientation
+                pos_marker = offset.position
+
+                t = TransformStamped()
+                t.header.stamp = now
+                t.header.frame_id = mar
+                t.child_frame_id = obj
+                t.transform.translation.x = pos_marker[0]
+                t.transform.translation.y = pos_marker[1]
+                t.transform.translation.z = pos_marker[2]
+                t.transform.rotation.x = rot_marker[0]
+                t.transform.rotation.y = rot_marker[1]
+                t.transform.rotation.z = rot_marker[2]
+                t.transform.rotation.w = rot_marker[3]
+                return t
+        return None
+
+    # Reads back from tf the pose wrt. the camera of the object frames in 'frames'.
+    # This returns the pose published in the previous cycle.
+    def lookup_objects(self, frames):
+        poses = {}
+        failed = []
+        for obj in frames:
+            try:
+                poses[obj] = self.tfBuffer.lookup_transform(self.frame, obj, rospy.Time()).transform
+            except (tf2_ros.LookupException, tf2_ros.ConnectivityException,
+                    tf2_ros.ExtrapolationException):
+                failed.append(obj)
+        if failed:
+            self.stats.count('tf_failures', len(failed))
+            rospy.logwarn_throttle(5, 'No TF from %s to %s, no marker for them'
+                                   % (self.frame, ', '.join(failed)))
+        return poses
+
+    # Poses of the objects wrt. the common frame, computed from all their visible markers in
+    # all cameras. Each detection (camera -> marker pose, as received) is composed with the
+    # common frame -> camera transform, looked up once per camera, and with the marker offset.
+    # The estimates of each object are fused (weighted by 1 / distance^2 to the camera,
+    # outliers rejected). Returns the poses and the common frame -> object TFs.
+    def fuse_objects(self, obj_list, now):
+        records = [self.catalog.get(obj) for obj in obj_list]
+        seen = {}  # tag -> [(camera, stamp, pose)]
+        for (tag, camera, stamp, pose) in self.detections.sightings(
+                [tag for r in records for tag in r.markers], now.to_sec()):
+            if pose is not None:
+                seen.setdefault(tag, []).append((camera, stamp, pose))
+
+        cameras = {}
+        failed = []
+        for camera in set(c for sightings in seen.values() for (c, stamp, pose) in sightings):
+            if camera == self.frame:
+                cameras[camera] = ((0.0, 0.0, 0.0), (0.0, 0.0, 0.0, 1.0))
+                continue
+            try:
+                t = self.tfBuffer.lookup_transform(self.frame, camera, rospy.Time()).transform
+                cameras[camera] = ((t.translation.x, t.translation.y, t.translation.z),
+                                   (t.rotation.x, t.rotation.y, t.rotation.z, t.rotation.w))
+            except (tf2_ros.LookupException, tf2_ros.ConnectivityException,
+                    tf2_ros.ExtrapolationException):
+                failed.append(camera)
+
+        objs = []
+        groups = []
+        estimates = []  # (common -> camera, stamp, camera -> tag, marker offset)
+        for record in records:
+            visible = [(cameras[c], stamp, pose, record.offsets[tag])
+                       for tag in record.markers for (c, stamp, pose) in seen.get(tag, []) if c in cameras]
+            if visible:
+                groups.extend([len(objs)] * len(visible))
+                estimates.extend(visible)
+                objs.append(record.name)
+        if failed:
+            self.stats.count('tf_failures', len(failed))
+            rospy.logwarn_throttle(5, 'No TF from %s to %s' % (self.frame, ', '.join(failed)))
+        for obj in obj_list:
+            self.object_tags.pop(obj, None)
+        if not objs:
+            return {}, {}
+
+        (p, q) = compose([c[0] for c, s, d, o in estimates], [c[1] for c, s, d, o in estimates],
+                         [d[:3] for c, s, d, o in estimates], [d[3:] for c, s, d, o in estimates])
+        (p, q) = compose(p, q, [o.position for c, s, d, o in estimates], [o.orientation for c, s, d, o in estimates])
+        # Weight of a marker: 1 / squared distance to the camera that detected it
+        dist2 = np.array([d[0] ** 2 + d[1] ** 2 + d[2] ** 2 for c, s, d, o in estimates])
+        weights = 1.0 / np.maximum(dist2, 0.01)
+        (p, q, inliers) = fuse_poses(groups, p, q, weights, self.fusion_distance, self.fusion_angle)
+
+        # Tracking, the stamp of an object is the one of its newest marker
+        stamps = np.zeros(len(objs))
+        np.maximum.at(stamps, groups, [s for c, s, d, o in estimates])
+        stamps[stamps == 0.0] = now.to_sec()
+        with self.tracker_lock:
+            self.tracker.update(objs, stamps, p, q)
+            if self.filter_poses:
+                (p, q) = self.tracker.poses(objs)
+
+        poses = {}
+        frames = {}
+        for i, obj in enumerate(objs):
+            t = TransformStamped()
+            t.header.stamp = now
+            t.header.frame_id = self.frame
+            t.child_frame_id = obj
+            (t.transform.translation.x, t.transform.translation.y, t.transform.translation.z) = p[i].tolist()
+            (t.transform.rotation.x, t.transform.rotation.y, t.transform.rotation.z,
+             t.transform.rotation.w) = q[i].tolist()
+            frames[obj] = t
+            poses[obj] = t.transform
+        for g, (c, s, d, o), ok in zip(groups, estimates, inliers.tolist()):
+            if ok and o.tag not in self.object_tags.get(objs[g], []):
+                self.object_tags.setdefault(objs[g], []).append(o.tag)
+        return poses, frames
+
+    # Filtered state of a tracked object (see PoseTracker.state), None if it was never seen
+    def object_state(self, obj):
+        return self.tracker.state(obj)
+
+    # Poses of the objects predicted at 'stamp' (rospy.Time), object -> (position, quaternion)
+    def predict_poses(self, obj_list, stamp):
+        with self.tracker_lock:
+            objs = [obj for obj in obj_list if obj in self.tracker]
+            if not objs:
+                return {}
+            (p, q) = self.tracker.predict(objs, stamp.to_sec())
+        return dict(zip(objs, zip(p.tolist(), q.tolist())))
+
+    # Service: poses of the tracked objects predicted at the requested time
+    def predict_object_poses(self, req):
+        stamp = req.stamp if not req.stamp.is_zero() else rospy.Time.now()
+        objs = list(req.objects or self.visible_objects)
+        predicted = self.predict_poses(objs, stamp)
+        res = PredictObjectPosesResponse()
+        for obj in objs:
+            if obj not in predicted:
+                continue
+            pose = PoseStamped()
+            pose.header.stamp = stamp
+            pose.header.frame_id = self.frame
+            ((pose.pose.position.x, pose.pose.position.y, pose.pose.position.z),
+             (pose.pose.orientation.x, pose.pose.orientation.y, pose.pose.orientation.z,
+              pose.pose.orientation.w)) = predicted[obj]
+            res.names.append(obj)
+            res.poses.append(pose)
+        return res
+
     # Creates the object as a Marker() (pose is wrt /camera_optical_frame)
-    def obj_pos_orient(self, obj):
+    def obj_pos_orient(self, obj, t_cam, level=0):
         found_object = Marker()
         poses = 0
+        if t_cam is None:
+            return found_object, poses
+
+        record = self.catalog.get(obj)
+        # Object marker properties
+        found_object.pose.orientation = t_cam.rotation
+        found_object.pose.position = t_cam.translation
+        found_object.header.frame_id = self.frame
+        found_object.header.stamp = rospy.Time.now()
+        found_object.ns = obj
+        found_object.id = record.id
+        found_object.type = found_object.MESH_RESOURCE
+        found_object.action = found_object.ADD
+        found_object.mesh_resource = record.mesh
+        found_object.mesh_use_embedded_materials = True
+        found_object.scale.x = found_object.scale.y = found_object.scale.z = record.scale
+        found_object.color.r = found_object.color.g = found_object.color.b = 0
+        found_object.color.a = 0
+        found_object.lifetime = rospy.Time(1)
+        poses = len(record.grasp_poses)
+
+        # Decimated collision mesh (in meters) instead of the full mesh
+        lod = lod_resource(record.mesh_collision, level)
+        if lod is not None:
+            found_object.mesh_resource = lod
+            found_object.mesh_use_embedded_materials = False
+            found_object.scale.x = found_object.scale.y = found_object.scale.z = 1.0
+            found_object.color.r = found_object.color.g = found_object.color.b = 0.7
+            found_object.color.a = 1.0
+
+        return found_object, poses
+
+    # Create markers for each grasping pose of an object. The markers only depend on the
+    # database, they are built once and only their time stamp changes afterwards.
+    def poses_markers(self, obj, n, level=0):
+        record = self.catalog.get(obj)
+        cached = self.marker_cache.get((obj, n, level))
+        if cached is None or cached[0] is not record:
+            cached = (record,) + self.grasp_markers(record, n, level, self.gripper_meshes)
+            self.marker_cache[(obj, n, level)] = cached
+        (record, mar, finger1, finger2) = cached
+
+        now = rospy.Time.now()
+        for m in (mar, finger1, finger2):
+            if m is not None:
+                m.header.stamp = now
+        pos = record.grasp_poses[n].position
+        orient = record.grasp_poses[n].orientation
+        return mar, pos[0], pos[1], pos[2], orient, finger1, finger2
+
+    # Markers for the gripper base and both fingers at grasping pose n of an object, using the
+    # meshes of LOD 'level'. If 'gripper' has the triangles of the base and finger meshes, the
+    # gripper is a single TRIANGLE_LIST marker of three boxes (fingers are None).
+    @staticmethod
+    def grasp_markers(record, n, level=0, gripper=None):
+        grasp = record.grasp_poses[n]
+        if gripper is not None:
+            mar = Marker()
+            mar.header.frame_id = grasp.name
+            mar.ns = grasp.name
+            mar.id = record.id * 100 + n
+            mar.type = mar.TRIANGLE_LIST
+            mar.action = mar.ADD
+            mar.color.a = 0.5
+            mar.lifetime = rospy.Time(1)
+            mar.color.g = 0.5
+            mar.color.r = mar.color.b = 0.6
+            mar.scale.x = mar.scale.y = mar.scale.z = 1.0
+            mar.pose.orientation.w = 1.0
+            triangles = gripper_triangles(gripper[0], gripper[1], record.gripper_opening)
+            mar.points = [Point(*v) for v in triangles.reshape(-1, 3).tolist()]
+            return mar, None, None
 
-        for k in self.yaml_file.keys():
-            if obj == k:  # For object in database
-                a = self.yaml_file[k]['marker']
-                for mar in a:
-                    for tag in self.matching:
-                        if tag == mar:  # if marker in object = marker found
-                            rot_marker = self.yaml_file[k][mar]['orientation']
-                            pos_marker = self.yaml_file[k][mar]['position']
-
-                            # Publish object tf
-                            t = TransformStamped()
-                            t.header.stamp = rospy.Time.now()
-                            t.header.frame_id = mar
-                            t.child_frame_id = obj
-                            t.transform.translation.x = pos_marker[0]
-                            t.transform.translation.y = pos_marker[1]
-                            t.transform.translation.z = pos_marker[2]
-                            t.transform.rotation.x = rot_marker[0]
-                            t.transform.rotation.y = rot_marker[1]
-                            t.transform.rotation.z = rot_marker[2]
-                            t.transform.rotation.w = rot_marker[3]
-                            self.br.sendTransform(t)
-
-                            try:
-                                # Pose of object wrt /camera
-                                t_cam = self.tfBuffer.lookup_transform(self.camera_frame, obj, rospy.Time())
-
-                            except (tf2_ros.LookupException, tf2_ros.ConnectivityException,
-                                    tf2_ros.ExtrapolationException) as exc:
-                                print '\nNo TF found, returning empty marker\n', exc
-                                return found_object, poses
-                            # If no exception
-                            else:
-                                # Object marker properties
-                                found_object.pose.orientation = t_cam.transform.rotation
-                                found_object.pose.position = t_cam.transform.translation
-                                found_object.header.frame_id = self.camera_frame
-                                found_object.header.stamp = rospy.Time.now()
-                                found_object.ns = obj
-                                found_object.id = self.yaml_file[k]['id']
-                                found_object.type = found_object.MESH_RESOURCE
-                                found_object.action = found_object.ADD
-                                found_object.mesh_resource = self.yaml_file[k]['mesh']
-                                found_object.mesh_use_embedded_materials = True
-                                found_object.scale.x = found_object.scale.y = found_object.scale.z = self.yaml_file[k][
-                                    'scale']
-                                found_object.color.r = found_object.color.g = found_object.color.b = 0
-                                found_object.color.a = 0
-                                found_object.lifetime = rospy.Time(1)
-                                if obj != 'kitchen_table':
-                                    poses = len(self.yaml_file[k]['grasping_poses'])
-                                else:
-                                    poses = 0
-
-                            return found_object, poses
-
-    # Create markers for each grasping pose of an object
-    def poses_markers(self, obj, n):
         mar = Marker()
+        finger1 = Marker()
+        finger2 = Marker()
+        for m in (mar, finger1, finger2):
+            m.type = m.MESH_RESOURCE
+            m.action = m.ADD
+            m.color.a = 0.5
+            m.lifetime = rospy.Time(1)
+            m.color.g = 0.5
+            m.color.r = m.color.b = 0.6
+            m.scale.x = m.scale.y = m.scale.z = 0.01
+            m.mesh_use_embedded_materials = True
+
+        # Gripper base, placed at the grasping pose
+        mar.header.frame_id = record.name
+        mar.ns = grasp.name
+        mar.id = record.id * 100 + n
+        pos = grasp.position
+        orient = grasp.orientation
+        mar.pose.position.x = pos[0]
+        mar.pose.position.y = pos[1]
+        mar.pose.position.z = pos[2]
+        mar.mesh_resource = lod_resource(GRIPPER_BASE_MESH, level) or GRIPPER_BASE_MESH
+        mar.pose.orientation.x = orient[0]
+        mar.pose.orientation.y = orient[1]
+        mar.pose.orientation.z = orient[2]
+        mar.pose.orientation.w = orient[3]
 
-        for k in self.yaml_file.keys():
-            if obj == k:
-                # Marker properties
-                mar.header.frame_id = obj
-                mar.header.stamp = rospy.Time.now()
-                mar.ns = obj + '_' + self.yaml_file[k]['grasping_poses'][n]['p_id']
-                mar.id = self.yaml_file[k]['id'] * 100 + n
-                mar.type = mar.MESH_RESOURCE
-                mar.action = mar.ADD
-                mar.color.a = 0.5
-                mar.lifetime = rospy.Time(1)
-                mar.color.g = 0.5
-                mar.color.r = mar.color.b = 0.6
-                mar.scale.x = mar.scale.y = mar.scale.z = 0.01
-                # Marker pose
-                pos = self.yaml_file[k]['grasping_poses'][n]['position']
-                orient = self.yaml_file[k]['grasping_poses'][n]['orientation']
-                mar.pose.position.x = pos[0]
-                mar.pose.position.y = pos[1]
-                mar.pose.position.z = pos[2]
-                mar.mesh_resource = 'package://iai_markers_tracking/meshes/gripper_base.stl'
-                mar.mesh_use_embedded_materials = True
-                mar.pose.orientation.x = orient[0]
-                mar.pose.orientation.y = orient[1]
-                mar.pose.orientation.z = orient[2]
-                mar.pose.orientation.w = orient[3]
-                finger1 = copy.deepcopy(mar)
-                finger1.mesh_resource = 'package://iai_markers_tracking/meshes/gripper_finger.stl'
-                finger1.ns = mar.ns + '_f1'
-                finger1.id = self.yaml_file[k]['id'] * 1000 + n
-                finger1.header.frame_id = obj + '_' + self.yaml_file[k]['grasping_poses'][n]['p_id']
-                finger1.pose.position.x = -(self.yaml_file[k]['gripper_opening']) / 2
-                finger1.pose.position.y = 0
-                finger1.pose.position.z = 0
-                finger1.pose.orientation.x = 0.0
-                finger1.pose.orientation.y = 0.0
-                finger1.pose.orientation.z = 0.0
-                finger1.pose.orientation.w = 0.1
-                finger2 = copy.deepcopy(finger1)
-                finger2.pose.position.x = (self.yaml_file[k]['gripper_opening']) / 2
-                finger2.pose.position.y = 0.005
-                finger2.pose.orientation.z = 1.0
-                finger2.pose.orientation.w = 0.0
-                finger2.ns = mar.ns + '_f2'
-                finger1.id = self.yaml_file[k]['id'] * 2000 + n
-                return mar, pos[0], pos[1], pos[2], orient, finger1, finger2
+        # Fingers, wrt. the grasping pose frame
+        for m in (finger1, finger2):
+            m.mesh_resource = lod_resource(GRIPPER_FINGER_MESH, level) or GRIPPER_FINGER_MESH
+            m.header.frame_id = grasp.name
+        finger1.ns = mar.ns + '_f1'
+        finger1.id = record.id * 2000 + n
+        finger1.pose.position.x = -record.gripper_opening / 2
+        finger1.pose.orientation.w = 0.1
+        finger2.ns = mar.ns + '_f2'
+        finger2.id = record.id * 1000 + n
+        finger2.pose.position.x = record.gripper_opening / 2
+        finger2.pose.position.y = 0.005
+        finger2.pose.orientation.z = 1.0
+        return mar, finger1, finger2
 
     # Published the /tf for all objects and the markers (of the grasping poses)
     def publish_obj(self, obj_list):
@@ -225,71 +587,415 @@ class ObjectGraspingMarker:
         markers = {}
         finger1 = {}
         finger2 = {}
+        if self.frame is None:
+            rospy.logwarn_throttle(5, 'No camera_info received yet, objects not published')
+            return markers, found_obj, finger1, finger2
+
+        # Publish the object TFs, all in one message
+        now = rospy.Time.now()
+        start = time.time()
+        if self.direct_pose:
+            (poses_cam, frames) = self.fuse_objects(obj_list, now)
+        else:
+            frames = {}
+            for obj in obj_list:
+                t = self.object_frame(obj, now)
+                if t is not None:
+                    frames[obj] = t
+        if frames:
+            self.br.sendTransform(list(frames.values()))
+        if not self.direct_pose:
+            for obj in obj_list:
+                self.object_tags.pop(obj, None)
+            for obj, t in frames.items():
+                self.object_tags[obj] = [t.header.frame_id]
+            poses_cam = self.lookup_objects(frames)
+        self.stats.stage('object_poses', time.time() - start)
+        levels = self.lod_levels(obj_list)
+        for obj, t in poses_cam.items():
+            self.object_poses[obj] = ((t.translation.x, t.translation.y, t.translation.z),
+                                      (t.rotation.x, t.rotation.y, t.rotation.z, t.rotation.w), now, self.frame)
+        if self.reach_map is not None:
+            self.update_reachability([obj for obj in obj_list if obj in poses_cam])
+
         for obj in obj_list:
             markers[obj] = {}
             finger1[obj] = {}
             finger2[obj] = {}
-            pose_list = []
-            (found_obj[obj], poses) = ObjectGraspingMarker.obj_pos_orient(self, obj)
+            level = levels.get(obj, 0)
+            (found_obj[obj], poses) = ObjectGraspingMarker.obj_pos_orient(self, obj, poses_cam.get(obj), level)
 
             # Create markers for the grasping poses
-            now = rospy.Time.now()
+            reachable = self.grasp_reachability(self.catalog.get(obj)) if self.reach_map is not None else None
             for n in range(poses):
+                if reachable is not None and self.reach_filter and not reachable[n]:
+                    continue
                 # Markers for gripper base, left and right finger
                 (markers[obj][n], x, y, z, orien, finger1[obj][n], finger2[obj][n]) = \
-                    ObjectGraspingMarker.poses_markers(self, obj, n)
-                pose_list.append(markers[obj][n].ns)
-
-                # Marker TF (static transformation)
-                static_tf = TransformStamped()
-                static_tf.header.stamp = now
-                static_tf.header.frame_id = obj
-                static_tf.child_frame_id = markers[obj][n].ns
-                static_tf.transform.translation.x = x
-                static_tf.transform.translation.y = y
-                static_tf.transform.translation.z = z
-                static_tf.transform.rotation.x = orien[0]
-                static_tf.transform.rotation.y = orien[1]
-                static_tf.transform.rotation.z = orien[2]
-                static_tf.transform.rotation.w = orien[3]
-                
-                self.s_br.sendTransform(static_tf)
-
-                # Create a pre-grasping pose
-                pre_gp = copy.deepcopy(static_tf)
-                pre_gp.child_frame_id = 'pre-' + static_tf.child_frame_id
-                vec = array([0.0, 0.0, -0.08, 0.0])
-                translate = self.vector_rotation(orien,vec)
-                x_t = translate[0] + x
-                y_t = translate[1] + y
-                z_t = translate[2] + z
-                if abs(x_t) < abs(x):
-                    x_t = -translate[0] + x
-                if abs(y_t) < abs(y):
-                    y_t = -translate[1] + y
-                if abs(z_t) < abs(z):
-                    z_t = -translate[2] + z
-                if 'knorr' in static_tf.child_frame_id:
-                    x_t = -translate[0] + x
-                pre_gp.transform.translation.x = x_t
-                pre_gp.transform.translation.y = y_t
-                pre_gp.transform.translation.z = z_t
-
-
-                self.s_br.sendTransform(pre_gp)
-
-            if len(pose_list) > 0:
-                self.grasp_poses[obj] = pose_list
+                    ObjectGraspingMarker.poses_markers(self, obj, n, level)
+                if self.reach_map is not None:
+                    self.tint_markers((markers[obj][n], finger1[obj][n], finger2[obj][n]),
+                                      reachable[n] if reachable is not None else None)
+
+            if poses > 0:
+                self.grasp_poses[obj] = self.catalog.grasp_names(obj)
+
+        # Marker TFs (static transformations)
+        self.publish_static([obj for obj in obj_list if obj in poses_cam and self.catalog.get(obj).grasp_poses])
 
         return markers, found_obj, finger1, finger2
 
+    # Publishes the detected objects (obj_list has all visible objects) with their last pose,
+    # markers and confidence. With ~objects_on_change it is only sent when an object appears,
+    # disappears, moves or changes markers, or after ~objects_keepalive seconds.
+    def publish_detected(self, obj_list):
+        now = rospy.Time.now()
+        state = {}
+        msg = DetectedObjects()
+        msg.header.stamp = now
+        msg.header.frame_id = self.frame or ''
+        for obj in obj_list:
+            record = self.catalog.get(obj)
+            pose = self.object_poses.get(obj)
+            if record is None or pose is None:
+                continue
+            d = DetectedObject()
+            d.name = obj
+            d.id = record.id
+            (p, q, d.pose.header.stamp, d.pose.header.frame_id) = pose
+            (d.pose.pose.position.x, d.pose.pose.position.y, d.pose.pose.position.z) = p
+            (d.pose.pose.orientation.x, d.pose.pose.orientation.y, d.pose.pose.orientation.z,
+             d.pose.pose.orientation.w) = q
+            d.tags = self.object_tags.get(obj, [])
+            tracked = self.object_state(obj)
+            if tracked is not None:
+                (d.velocity.linear.x, d.velocity.linear.y, d.velocity.linear.z) = tracked['velocity'].tolist()
+                (d.velocity.angular.x, d.velocity.angular.y, d.velocity.angular.z) = \
+                    tracked['angular_velocity'].tolist()
+                d.covariance = tracked['covariance'].ravel().tolist()
+            # Share of the markers of the object used for its pose, lower when they get old
+            seen = [self.detections.tag_seen.get(tag) for tag in d.tags]
+            age = now.to_sec() - max([t for t in seen if t is not None] or [0.0])
+            d.confidence = len(d.tags) / float(len(record.markers)) * \
+                max(0.0, 1.0 - age / self.detections.ttl) if record.markers else 0.0
+            msg.objects.append(d)
+            state[obj] = (tuple(p) + tuple(q), tuple(d.tags))
+
+        (last, stamp) = self.last_detected
+        if self.on_change and last is not None and now.to_sec() - stamp < self.objects_keepalive and \
+                set(state) == set(last) and \
+                not any(state[obj][1] != last[obj][1] or self.detections.moved(last[obj][0], state[obj][0])
+                        for obj in state):
+            return False
+        self.detected_pub.publish(msg)
+        self.last_detected = (state, now.to_sec())
+        return True
+
+    # Reachability of the grasping poses of the objects (see ReachabilityMap), from the object
+    # poses of this cycle and one lookup of the camera pose in the frame of the map
+    def update_reachability(self, obj_list):
+        records = [self.catalog.get(obj) for obj in obj_list]
+        records = [r for r in records if r.grasp_poses]
+        if not records:
+            return
+        try:
+            t = self.tfBuffer.lookup_transform(self.reach_map.frame, self.frame, rospy.Time()).transform
+        except (tf2_ros.LookupException, tf2_ros.ConnectivityException, tf2_ros.ExtrapolationException):
+            self.stats.count('tf_failures')
+            rospy.logwarn_throttle(5, 'No TF from %s to %s, grasping poses not checked for reachability'
+                                   % (self.reach_map.frame, self.frame))
+            for r in records:
+                self.reachable.pop(r.name, None)
+            return
+        obj_pose = [self.object_poses[r.name] for r in records for g in r.grasp_poses]
+        (p, q) = compose([pose[0] for pose in obj_pose], [pose[1] for pose in obj_pose],
+                         [g.position for r in records for g in r.grasp_poses],
+                         [g.orientation for r in records for g in r.grasp_poses])
+        n = len(p)
+        (p, q) = compose(np.tile([t.translation.x, t.translation.y, t.translation.z], (n, 1)),
+                         np.tile([t.rotation.x, t.rotation.y, t.rotation.z, t.rotation.w], (n, 1)), p, q)
+        reachable = self.reach_map.reachable(p, q).any(axis=1).tolist()
+        start = 0
+        for r in records:
+            self.reachable[r.name] = (r, reachable[start:start + len(r.grasp_poses)])
+            start += len(r.grasp_poses)
+
+    # Reachability of each grasping pose of 'record', None if unknown. It was computed for a
+    # version of the record and is unknown once the database reloads the object.
+    def grasp_reachability(self, record):
+        entry = self.reachable.get(record.name) if record is not None else None
+        return entry[1] if entry is not None and entry[0] is record else None
+
+    # Colors the markers of a grasping pose by reachability. The markers are cached and shared
+    # between cycles, so an unknown reachability (None) restores the color of grasp_markers().
+    @staticmethod
+    def tint_markers(markers, reachable):
+        if reachable is None:
+            color = (0.6, 0.5, 0.6)
+        else:
+            color = (0.2, 0.8, 0.2) if reachable else (0.9, 0.2, 0.2)
+        for m in markers:
+            if m is not None:
+                (m.color.r, m.color.g, m.color.b) = color
+
+    # Level of detail of the markers of each object (0: full meshes). With ~lod 'count' it
+    # grows with the number of visible objects, with 'distance' with the distance from the camera to
+    # the closest visible marker of the object. ~lod_thresholds are the limits of each level.
+    def lod_levels(self, obj_list):
+        if self.lod_mode == 'count':
+            # All visible objects, obj_list only has the changed ones in the event driven loop
+            level = sum(1 for t in self.lod_thresholds if len(self.visible_objects) > t)
+            return dict((obj, level) for obj in obj_list)
+        levels = {}
+        if self.lod_mode == 'distance':
+            for obj in obj_list:
+                seen = [p for tag in self.catalog.get(obj).markers for p in self.detections.tag_poses(tag)]
+                dist = [math.sqrt(p[0] ** 2 + p[1] ** 2 + p[2] ** 2) for p in seen]
+                if dist:
+                    levels[obj] = sum(1 for t in self.lod_thresholds if min(dist) > t)
+        return levels
+
+    # Static transforms of the grasping and pre-grasping poses of an object,
+    # they only depend on the database
+    def grasp_transforms(self, record):
+        transforms = []
+        for g in record.grasp_poses:
+            (x, y, z) = g.position
+            orien = g.orientation
+            static_tf = TransformStamped()
+            static_tf.header.frame_id = record.name
+            static_tf.child_frame_id = g.name
+            static_tf.transform.translation.x = x
+            static_tf.transform.translation.y = y
+            static_tf.transform.translation.z = z
+            static_tf.transform.rotation.x = orien[0]
+            static_tf.transform.rotation.y = orien[1]
+            static_tf.transform.rotation.z = orien[2]
+            static_tf.transform.rotation.w = orien[3]
+            transforms.append(static_tf)
+
+            # Pre-grasping pose (computed with the database, see pose_math.pre_grasp_positions)
+            pre_gp = TransformStamped()
+            pre_gp.header.frame_id = record.name
+            pre_gp.child_frame_id = 'pre-' + static_tf.child_frame_id
+            pre_gp.transform.rotation = static_tf.transform.rotation
+            (pre_gp.transform.translation.x, pre_gp.transform.translation.y,
+             pre_gp.transform.translation.z) = g.pre_position
+            transforms.append(pre_gp)
+        return transforms
+
+    # Sends the grasping pose TFs of objects seen for the first time (or changed in the
+    # database). /tf_static is latched and only keeps the last message of this node,
+    # so every known static frame goes in that single message.
+    def publish_static(self, obj_list):
+        changed = False
+        now = rospy.Time.now()
+        for obj in obj_list:
+            record = self.catalog.get(obj)
+            old = self.static_objects.get(obj)
+            if old is record:
+                continue
+            if old is not None:
+                for name in old.grasp_names:
+                    self.static_tfs.pop(name, None)
+                    self.static_tfs.pop('pre-' + name, None)
+            for t in self.grasp_transforms(record):
+                t.header.stamp = now
+                self.static_tfs[t.child_frame_id] = t
+            self.static_objects[obj] = record
+            changed = True
+        if changed:
+            self.s_br.sendTransform(list(self.static_tfs.values()))
+
+    # MarkerArray with the objects in obj_list and their grasping poses
+    def marker_array(self, obj_list):
+        marker_array = MarkerArray()
+        (markers, found_obj, finger1, finger2) = self.publish_obj(obj_list)
+
+        for obj in found_obj:
+            marker_array.markers.append(found_obj[obj])
+            for n in markers[obj]:
+                marker_array.markers.append(markers[obj][n])
+                if finger1[obj][n] is not None:
+                    marker_array.markers.append(finger1[obj][n])
+                    marker_array.markers.append(finger2[obj][n])
+        return marker_array
+
+    # Publishes the markers of the objects in obj_list. With ~delta_markers only the changes
+    # since the last publication are sent; 'full' tells that obj_list has all visible objects.
+    def publish_markers(self, marker_pub, obj_list, full=True):
+        marker_array = self.marker_array(obj_list)
+        if self.delta is not None:
+            marker_array.markers = self.delta.encode(marker_array.markers, rospy.get_time(), full)
+            if not marker_array.markers:
+                return False
+        marker_pub.publish(marker_array)
+        return True
+
     #  ROS service for getting the name of the grasping poses of an object
     def list_grasping_poses(self, m):
-        for n in self.grasp_poses:
-            if n == m.object:
-                g_p = [self.grasp_poses[m.object]]
-                return g_p
-            continue
+        return GetObjectInfoResponse(self.grasp_poses.get(m.object, []))
+
+    # ROS service for the grasping poses of a detected object that are free of collisions with
+    # the detected objects (see GraspFilter), the largest clearance first
+    def filter_grasping_poses(self, req):
+        # Service thread: copy first, the main loop adds objects and reloads the database meanwhile
+        catalog = self.catalog
+        record = catalog.get(req.object)
+        visible = set(catalog.object_of(tag) for tag in self.matching)
+        poses = dict((obj, pose) for obj, pose in dict(self.object_poses).items() if obj in visible)
+        if record is None or req.object not in poses:
+            return GetGraspPosesResponse([], [], [], False)
+        scene = [catalog.get(obj) for obj in sorted(poses) if obj in catalog]
+        (names, clearance, rejected) = self.grasp_filter.rank(record, scene, poses)
+        reachable = self.grasp_reachability(record) if self.reach_filter else None
+        if reachable is not None:
+            index = dict((name, n) for n, name in enumerate(record.grasp_names))
+            keep = [k for k, name in enumerate(names) if reachable[index[name]]]
+            rejected = rejected + [name for k, name in enumerate(names) if k not in keep]
+            (names, clearance) = ([names[k] for k in keep], [clearance[k] for k in keep])
+        return GetGraspPosesResponse(names, clearance, rejected, True)
+
+    # ROS service for the grasping and pre-grasping poses, gripper opening and last pose of
+    # several objects in one call, answered from the catalog without TF lookups
+    def objects_info(self, req):
+        catalog = self.catalog
+        names = req.objects or sorted(catalog.objects)
+        return GetObjectsInfoResponse([self.object_info(catalog, name) for name in names])
+
+    def object_info(self, catalog, name):
+        info = ObjectInfo()
+        info.name = name
+        record = catalog.get(name)
+        if record is None:
+            return info
+        info.found = True
+        info.id = record.id
+        info.gripper_opening = record.gripper_opening
+        info.grasp_poses = self.grasp_pose_msgs(record)
+        pose = self.object_poses.get(name)
+        if pose is not None:
+            (p, q, info.pose.header.stamp, info.pose.header.frame_id) = pose
+            (info.pose.pose.position.x, info.pose.pose.position.y, info.pose.pose.position.z) = p
+            (info.pose.pose.orientation.x, info.pose.pose.orientation.y, info.pose.pose.orientation.z,
+             info.pose.pose.orientation.w) = q
+        else:
+            info.pose.pose.orientation.w = 1.0
+        return info
+
+    # GraspPose messages of an object, they only depend on the database
+    def grasp_pose_msgs(self, record):
+        cached = self.grasp_msgs.get(record.name)
+        if cached is None or cached[0] is not record:
+            msgs = []
+            for g in record.grasp_poses:
+                msg = GraspPose()
+                msg.name = g.name
+                for (pose, position) in ((msg.pose, g.position), (msg.pre_grasp_pose, g.pre_position)):
+                    (pose.position.x, pose.position.y, pose.position.z) = position
+                    (pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w) = g.orientation
+                msgs.append(msg)
+            cached = (record, msgs)
+            self.grasp_msgs[record.name] = cached
+        return cached[1]
+
+    # Timer callback, publishes the stage timings and counters since the last call, the
+    # database metrics and the camera statistics. Warns about slow cycles (mean over
+    # ~diagnostics_cycle_budget seconds), failed TF lookups and dropped markers.
+    def publish_diagnostics(self, event):
+        (period, stages, counters) = self.stats.snapshot()
+        values = [('period', '%.3f' % period)]
+        cycles = stages.get('cycle', [0, 0.0, 0.0])
+        values.append(('cycle_rate', '%.2f' % (cycles[0] / max(period, 1e-9))))
+        for name in sorted(stages):
+            (n, total, longest) = stages[name]
+            values.append((name + '_mean_ms', '%.3f' % (total / n * 1000.0)))
+            values.append((name + '_max_ms', '%.3f' % (longest * 1000.0)))
+        for name in sorted(counters):
+            values.append((name, str(counters[name])))
+        values.append(('visible_markers', str(len(self.matching))))
+        for name in sorted(self.db_metrics):
+            values.append(('database_' + name, str(self.db_metrics[name])))
+        with self.camera_lock:
+            cameras = sorted((camera, tuple(stats)) for camera, stats in self.camera_stats.items())
+        for camera, (n, mean, longest) in cameras:
+            values.append(('camera %s detections' % camera, str(n)))
+            values.append(('camera %s latency_mean_ms' % camera, '%.3f' % (mean * 1000.0)))
+            values.append(('camera %s latency_max_ms' % camera, '%.3f' % (longest * 1000.0)))
+
+        problems = []
+        if cycles[0] and cycles[1] / cycles[0] > self.cycle_budget:
+            problems.append('slow cycles')
+        if counters.get('tf_failures'):
+            problems.append('TF lookups failed')
+        if counters.get('dropped_tags'):
+            problems.append('markers dropped')
+        status = DiagnosticStatus()
+        status.level = DiagnosticStatus.WARN if problems else DiagnosticStatus.OK
+        status.name = 'object_db_reader'
+        status.message = ', '.join(problems) or 'OK'
+        status.hardware_id = rospy.get_name()
+        status.values = [KeyValue(k, v) for k, v in values]
+        msg = DiagnosticArray()
+        msg.header.stamp = rospy.Time.now()
+        msg.status = [status]
+        self.diag_pub.publish(msg)
+
+    # ROS service, samples the stacks of the threads of the node for a while and writes them
+    # in the collapsed format of flamegraph.pl
+    def dump_profile(self, req):
+        path = req.path or os.path.join(rospkg.get_ros_home(), 'iai_markers_tracking',
+                                        time.strftime('profile_%Y%m%d_%H%M%S.txt'))
+        if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+            os.makedirs(os.path.dirname(os.path.abspath(path)))
+        stacks = sample_stacks(req.duration or 5.0)
+        write_stacks(stacks, path)
+        rospy.loginfo('Profile of %d samples written to %s' % (sum(stacks.values()), path))
+        return DumpProfileResponse(path, sum(stacks.values()))
+
+
+# Event driven loop: only objects whose markers appeared or moved are updated, at most
+# max_rate times per second. All visible objects are republished every keepalive period
+# so their markers do not expire in RViz.
+def event_loop(grasp_class, marker_pub):
+    min_period = 1.0 / rospy.get_param('~max_rate', 30.0)
+    keepalive = rospy.get_param('~keepalive_period', 0.5)
+    last_full = last_pub = 0.0
+
+    while not rospy.is_shutdown():
+        changed = grasp_class.detections.wait_changes(max(0.0, last_full + keepalive - rospy.get_time()))
+
+        # Coalesce bursts of detections
+        wait = last_pub + min_period - rospy.get_time()
+        if wait > 0:
+            rospy.sleep(wait)
+            changed |= grasp_class.detections.take_changes()
+
+        stats = grasp_class.stats
+        stats.begin()
+        grasp_class.apply_reload()
+        now = rospy.get_time()
+        grasp_class.detections.prune(now)
+        stats.lap('reload')
+        matching = grasp_class.match_objects()
+        stats.lap('match_objects')
+        obj_list = grasp_class.find_obj(matching)
+        stats.lap('find_obj')
+        visible_objs = obj_list
+
+        full = now - last_full >= keepalive
+        if full:
+            last_full = now
+        else:
+            visible = set(matching)
+            update = set(grasp_class.catalog.object_of(tag) for tag in changed if tag in visible)
+            obj_list = [obj for obj in obj_list if obj in update]
+        if (obj_list or full) and grasp_class.publish_markers(marker_pub, obj_list, full):
+            last_pub = rospy.get_time()
+        stats.lap('publish_markers')
+        grasp_class.publish_detected(visible_objs)
+        stats.lap('publish_detected')
+        stats.end()
 
 
 # Main function
@@ -297,35 +1003,37 @@ def main():
     grasp_class = ObjectGraspingMarker()
     r = rospy.Rate(5)
     rospy.sleep(0.5)
-    scheduler = BackgroundScheduler()
-    scheduler.add_job(grasp_class.clear_v, 'interval', seconds=0.5)
-    scheduler.start()
 
     marker_pub = rospy.Publisher('visualization_marker_array', MarkerArray, queue_size=5)
 
     # Open database YAML file
     grasp_class.op_file()
 
+    if rospy.get_param('~event_driven', False):
+        event_loop(grasp_class, marker_pub)
+
+    stats = grasp_class.stats
     while not rospy.is_shutdown():
-        marker_array = MarkerArray()
+        # Use the latest version of the database
+        stats.begin()
+        grasp_class.apply_reload()
+        grasp_class.detections.prune(rospy.get_time())
+        stats.lap('reload')
 
         # Find frames that are object markers
         matching = grasp_class.match_objects()
+        stats.lap('match_objects')
 
         # Check if the objects are registered in the data base
         obj_list = grasp_class.find_obj(matching)
+        stats.lap('find_obj')
 
-        # Get the transforms from the objects to the map frame
-        (markers, found_obj, finger1, finger2) = grasp_class.publish_obj(obj_list)
-
-        for obj in found_obj:
-            marker_array.markers.append(found_obj[obj])
-            for n in markers[obj]:
-                marker_array.markers.append(markers[obj][n])
-                marker_array.markers.append(finger1[obj][n])
-                marker_array.markers.append(finger2[obj][n])
-
-        marker_pub.publish(marker_array)
+        # Get the transforms from the objects to the map frame and their markers
+        grasp_class.publish_markers(marker_pub, obj_list)
+        stats.lap('publish_markers')
+        grasp_class.publish_detected(obj_list)
+        stats.lap('publish_detected')
+        stats.end()
         r.sleep()
 
     rospy.spin()
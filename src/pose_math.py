@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 Universitaet Bremen - Institute for Artificial Intelligence (Prof. Beetz)
+#
+# Author: Minerva Gabriela Vargas Gleason <minervavargasg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+# Quaternion and pose helpers working on arrays of poses. Quaternions are (x, y, z, w)
+# as in geometry_msgs and tf.transformations.
+
+import numpy as np
+
+_EPS = np.finfo(float).eps * 4.0
+
+# Pre-grasp rules for each axis, see pre_grasp_positions()
+AWAY, FLIP, KEEP = 0, 1, 2
+PRE_GRASP_RULES = {'away': AWAY, 'flip': FLIP, 'keep': KEEP}
+
+
+# (N, 3, 3) rotation matrices of (N, 4) quaternions, same arithmetic as
+# tf.transformations.quaternion_matrix
+def quaternion_matrices(q):
+    q = np.array(q, dtype=np.float64, ndmin=2)
+    nq = np.sum(q * q, axis=1)
+    small = nq < _EPS
+    q = q * np.sqrt(2.0 / np.where(small, 1.0, nq))[:, None]
+    q[small] = 0.0
+    o = q[:, :, None] * q[:, None, :]
+    m = np.empty((len(q), 3, 3))
+    m[:, 0, 0] = 1.0 - o[:, 1, 1] - o[:, 2, 2]
+    m[:, 0, 1] = o[:, 0, 1] - o[:, 2, 3]
+    m[:, 0, 2] = o[:, 0, 2] + o[:, 1, 3]
+    m[:, 1, 0] = o[:, 0, 1] + o[:, 2, 3]
+    m[:, 1, 1] = 1.0 - o[:, 0, 0] - o[:, 2, 2]
+    m[:, 1, 2] = o[:, 1, 2] - o[:, 0, 3]
+    m[:, 2, 0] = o[:, 0, 2] - o[:, 1, 3]
+    m[:, 2, 1] = o[:, 1, 2] + o[:, 0, 3]
+    m[:, 2, 2] = 1.0 - o[:, 0, 0] - o[:, 1, 1]
+    return m
+
+
+# Positions of the pre-grasping poses of N grasping poses (quaternions q (N, 4) and
+# positions p (N, 3)). The gripper moves back 'distance' along its approach (z) axis,
+# the x and z components of that offset are mirrored. 'rules' (N, 3) decides the sign of
+# the offset on each axis: AWAY keeps the sign that moves the pose away from the object
+# origin, FLIP and KEEP always use the mirrored or the original offset.
+def pre_grasp_positions(q, p, distance=0.08, rules=AWAY):
+    p = np.array(p, dtype=np.float64, ndmin=2)
+    m = quaternion_matrices(q)
+    # '+ 0.0' gives +0.0 for a -0.0 component, as the matmul with a 4-vector did
+    approach = m[:, :, 2] * -np.reshape(distance, (-1, 1)) + 0.0
+    t = approach * np.array([-1.0, 1.0, -1.0])
+    towards = t + p
+    away = -t + p
+    rules = np.broadcast_to(rules, p.shape)
+    flip = (rules == FLIP) | ((rules == AWAY) & (np.abs(towards) < np.abs(p)))
+    return np.where(flip, away, towards)
+
+
+# Hamilton products q1 * q2 of (N, 4) quaternions
+def quaternion_multiply(q1, q2):
+    q1 = np.asarray(q1, dtype=np.float64)
+    q2 = np.asarray(q2, dtype=np.float64)
+    x1, y1, z1, w1 = np.moveaxis(q1, -1, 0)
+    x2, y2, z2, w2 = np.moveaxis(q2, -1, 0)
+    return np.stack((w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+                     w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+                     w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2,
+                     w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2), axis=-1)
+
+
+# Rotates (N, 3) vectors by (N, 4) unit quaternions
+def rotate_vectors(q, v):
+    q = np.asarray(q, dtype=np.float64)
+    v = np.asarray(v, dtype=np.float64)
+    u = q[..., :3]
+    t = 2.0 * np.cross(u, v)
+    return v + q[..., 3:] * t + np.cross(u, t)
+
+
+# Poses a * b, 'a' and 'b' given as positions (N, 3) and quaternions (N, 4)
+def compose(pa, qa, pb, qb):
+    return np.asarray(pa) + rotate_vectors(qa, pb), quaternion_multiply(qa, qb)
+
+
+# Index of the estimate with the largest weight in each of the n groups
+def _best_of_groups(groups, w, n):
+    order = np.lexsort((-w, groups))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = groups[order][1:] != groups[order][:-1]
+    best = np.zeros(n, dtype=np.intp)
+    best[groups[order][first]] = order[first]
+    return best
+
+
+# Component-wise median of the rows of x (M, k) in each of the n groups
+def _group_median(groups, n, x):
+    counts = np.bincount(groups, minlength=n)
+    starts = np.cumsum(counts) - counts
+    lo = np.maximum(starts + (counts - 1) // 2, 0)
+    hi = np.maximum(starts + counts // 2 - (counts == 0), 0)
+    med = np.empty((n, x.shape[1]))
+    for i in range(x.shape[1]):
+        v = x[np.lexsort((x[:, i], groups)), i]
+        med[:, i] = 0.5 * (v[lo] + v[hi])
+    return med
+
+
+# Quaternions brought to the hemisphere of the reference quaternion of their group
+def _align(groups, q, q_ref):
+    return np.where((np.sum(q * q_ref[groups], axis=1) < 0.0)[:, None], -q, q)
+
+
+# Weighted mean of the poses of each group
+def _group_mean(groups, n, p, q, w):
+    wsum = np.bincount(groups, w, n)
+    wsum[wsum == 0.0] = 1.0
+    pm = np.stack([np.bincount(groups, w * p[:, i], n) for i in range(3)], axis=1) / wsum[:, None]
+    qm = np.stack([np.bincount(groups, w * q[:, i], n) for i in range(4)], axis=1)
+    return pm, qm / np.linalg.norm(qm, axis=1)[:, None]
+
+
+# Fuses M pose estimates (p (M, 3), q (M, 4), weights w (M,)) of n objects, groups (M,) is
+# the object index of each estimate. Estimates further than max_distance [m] or max_angle
+# [rad] from the median pose of their object are rejected. If all the estimates of an object
+# are rejected, the one with the largest weight is used.
+# Returns the fused positions (n, 3), quaternions (n, 4) and the inlier mask (M,).
+def fuse_poses(groups, p, q, w=None, max_distance=0.03, max_angle=0.35):
+    groups = np.asarray(groups, dtype=np.intp)
+    p = np.asarray(p, dtype=np.float64).reshape(-1, 3)
+    q = np.asarray(q, dtype=np.float64).reshape(-1, 4)
+    w = np.ones(len(p)) if w is None else np.asarray(w, dtype=np.float64)
+    n = int(groups.max()) + 1 if len(groups) else 0
+    best = _best_of_groups(groups, w, n)
+    q = _align(groups, q, q[best])
+
+    p_med = _group_median(groups, n, p)
+    q_med = _group_median(groups, n, q)
+    q_med /= np.maximum(np.linalg.norm(q_med, axis=1), _EPS)[:, None]
+    dist = np.linalg.norm(p - p_med[groups], axis=1)
+    dot = np.clip(np.abs(np.sum(q * q_med[groups], axis=1)), 0.0, 1.0)
+    inliers = (dist <= max_distance) & (2.0 * np.arccos(dot) <= max_angle)
+    none = np.bincount(groups, inliers, n) == 0
+    inliers[best[none]] = True
+
+    pm, qm = _group_mean(groups, n, p, q, w * inliers)
+    return pm, qm, inliers
+
+
+# Quaternions of roll, pitch, yaw angles (fixed axes x, y, z), as in URDF. Works on
+# scalars and on arrays of angles, returns the list [x, y, z, w].
+def euler_to_quat(r, p, y):
+    sr, sp, sy = np.sin(r / 2.0), np.sin(p / 2.0), np.sin(y / 2.0)
+    cr, cp, cy = np.cos(r / 2.0), np.cos(p / 2.0), np.cos(y / 2.0)
+    return [sr * cp * cy - cr * sp * sy,
+            cr * sp * cy + sr * cp * sy,
+            cr * cp * sy - sr * sp * cy,
+            cr * cp * cy + sr * sp * sy]
+
+
+# (N, 4) quaternions of (N, 3) roll, pitch, yaw angles
+def euler_to_quats(rpy):
+    rpy = np.asarray(rpy, dtype=np.float64).reshape(-1, 3)
+    return np.array(euler_to_quat(rpy[:, 0], rpy[:, 1], rpy[:, 2])).T
+
+
+# (n, 3) unit vectors spread evenly on the sphere (Fibonacci sphere)
+def sphere_directions(n):
+    k = np.arange(n) + 0.5
+    z = 1.0 - 2.0 * k / n
+    angle = np.pi * (1.0 + 5 ** 0.5) * k
+    r = np.sqrt(1.0 - z * z)
+    return np.stack((r * np.cos(angle), r * np.sin(angle), z), axis=1)
+
+
+# True if any of the poses 'new' ((7,) or (N, 7): position, quaternion) is more than
+# 'move_threshold' meters away from 'old' or turned more than 'turn_threshold' radians
+def poses_moved(old, new, move_threshold, turn_threshold):
+    old = np.asarray(old, dtype=np.float64)
+    new = np.asarray(new, dtype=np.float64)
+    d = new[..., :3] - old[..., :3]
+    if np.any(np.sum(d * d, axis=-1) > move_threshold ** 2):
+        return True
+    dot = np.abs(np.sum(old[..., 3:] * new[..., 3:], axis=-1))
+    return bool(np.any(dot < np.cos(turn_threshold / 2.0)))
+
+
+def quaternion_conjugate(q):
+    return np.asarray(q, dtype=np.float64) * np.array([-1.0, -1.0, -1.0, 1.0])
+
+
+# Rotation vectors (axis * angle, (N, 3)) of (N, 4) unit quaternions
+def quaternion_to_rotvec(q):
+    q = np.asarray(q, dtype=np.float64)
+    q = np.where(q[..., 3:] < 0.0, -q, q)
+    s = np.linalg.norm(q[..., :3], axis=-1)
+    angle = 2.0 * np.arctan2(s, q[..., 3])
+    scale = np.where(s > _EPS, angle / np.maximum(s, _EPS), 2.0)
+    return q[..., :3] * scale[..., None]
+
+
+# Unit quaternions (N, 4) of rotation vectors (N, 3)
+def rotvec_to_quaternion(r):
+    r = np.asarray(r, dtype=np.float64)
+    angle = np.linalg.norm(r, axis=-1)
+    half = 0.5 * angle
+    scale = np.where(angle > _EPS, np.sin(half) / np.maximum(angle, _EPS), 0.5)
+    return np.concatenate((r * scale[..., None], np.cos(half)[..., None]), axis=-1)
+
+
+# Separation of N oriented boxes 'a' and M boxes 'b' (centers (., 3), orthonormal axes as
+# rows of (., 3, 3) arrays, half sizes (., 3)), by the separating axis test on the 15 axes of
+# each pair, written in the frame of 'a'. Returns (N, M): the largest gap between the
+# projections of the two boxes, a lower bound of their distance when positive, the boxes
+# overlap when it is <= 0.
+def obb_separation(ca, ra, ea, cb, rb, eb):
+    ra = np.asarray(ra, dtype=np.float64)
+    rb = np.asarray(rb, dtype=np.float64)
+    (n, m) = (len(ra), len(rb))
+    # Components lead so the sums and maxima over them are operations on (N, M) arrays:
+    # r[i, j] = a_i . b_j, t[i] = center of b - center of a along a_i
+    r = np.ascontiguousarray(ra.reshape(-1, 3).dot(rb.reshape(-1, 3).T).reshape(n, 3, m, 3).transpose(1, 3, 0, 2))
+    d = np.asarray(cb, dtype=np.float64)[None, :, :] - np.asarray(ca, dtype=np.float64)[:, None, :]
+    t = np.einsum('nmk,nik->inm', d, ra)
+    ar = np.abs(r)
+    ea = np.asarray(ea, dtype=np.float64).T[:, :, None]   # (3, N, 1)
+    eb = np.asarray(eb, dtype=np.float64).T[:, None, :]   # (3, 1, M)
+
+    gap_a = np.abs(t) - ea - (ar[:, 0] * eb[0] + ar[:, 1] * eb[1] + ar[:, 2] * eb[2])
+    gap_b = (np.abs(t[0] * r[0] + t[1] * r[1] + t[2] * r[2]) - (ea[0] * ar[0] + ea[1] * ar[1] + ea[2] * ar[2]) -
+             eb)
+    # Axes a_i x b_j, not normalized: their length is sqrt(1 - r_ij^2). With i1 = i + 1 and
+    # i2 = i + 2 (mod 3), rows i1 and i2 are the views [1:4] and [2:5] of the doubled arrays.
+    r2 = np.concatenate((r, r))
+    t2 = np.concatenate((t, t))[:, None]
+    ar_i = np.concatenate((ar, ar))
+    ar_j = np.concatenate((ar, ar), axis=1)
+    ea2 = np.concatenate((ea, ea))[:, None]
+    eb2 = np.concatenate((eb, eb))[None]
+    dist = np.abs(t2[2:5] * r2[1:4] - t2[1:4] * r2[2:5])
+    radius = (ea2[1:4] * ar_i[2:5] + ea2[2:5] * ar_i[1:4] +
+              eb2[:, 1:4] * ar_j[:, 2:5] + eb2[:, 2:5] * ar_j[:, 1:4])
+    length = np.sqrt(np.maximum(1.0 - r * r, 0.0))
+    gap_c = np.where(length > 1e-6, (dist - radius) / np.maximum(length, 1e-6), -np.inf)
+    return np.concatenate((gap_a, gap_b, gap_c.reshape(9, n, m))).max(axis=0)
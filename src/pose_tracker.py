@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 Universitaet Bremen - Institute for Artificial Intelligence (Prof. Beetz)
+#
+# Author: Minerva Gabriela Vargas Gleason <minervavargasg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+# Filtering of the object poses. Every tracked object is a row of the state arrays and all
+# objects measured in a cycle are updated together.
+#  - Position: constant velocity Kalman filter, independent for x, y and z.
+#  - Orientation: low-pass filter of the quaternion plus a low-pass filtered angular velocity.
+
+import numpy as np
+from pose_math import quaternion_multiply, quaternion_conjugate, quaternion_to_rotvec, rotvec_to_quaternion
+
+
+class PoseTracker(object):
+    # accel_noise: std. deviation of the acceleration [m/s^2] (process noise)
+    # meas_noise: std. deviation of the measured positions [m]
+    # rot_gain: weight of a new orientation in the low-pass filter (0..1]
+    # max_gap: an object not measured for this many seconds is started again
+    def __init__(self, accel_noise=0.5, meas_noise=0.005, rot_gain=0.3, max_gap=1.0, capacity=16):
+        self.accel_var = accel_noise ** 2
+        self.meas_var = meas_noise ** 2
+        self.rot_gain = rot_gain
+        self.max_gap = max_gap
+        self.index = {}  # object name -> row
+        self.names = []
+        self.stamp = np.zeros(capacity)
+        self.pos = np.zeros((capacity, 3))
+        self.vel = np.zeros((capacity, 3))
+        self.p_pp = np.zeros((capacity, 3))  # Covariance per axis: position,
+        self.p_pv = np.zeros((capacity, 3))  # position-velocity
+        self.p_vv = np.zeros((capacity, 3))  # and velocity
+        self.rot = np.zeros((capacity, 4))
+        self.ang_vel = np.zeros((capacity, 3))
+
+    def _rows(self, names):
+        rows = []
+        for name in names:
+            row = self.index.get(name)
+            if row is None:
+                row = len(self.names)
+                if row == len(self.stamp):
+                    for attr in ('stamp', 'pos', 'vel', 'p_pp', 'p_pv', 'p_vv', 'rot', 'ang_vel'):
+                        a = getattr(self, attr)
+                        setattr(self, attr, np.concatenate((a, np.zeros_like(a))))
+                self.index[name] = row
+                self.names.append(name)
+            rows.append(row)
+        return np.array(rows, dtype=np.intp)
+
+    # New measurements: positions (M, 3) and quaternions (M, 4) of the objects 'names' at
+    # 'stamps' (M,) [s]. Measurements not newer than the last one of their object (the same
+    # detection again, or an older marker) are ignored.
+    def update(self, names, stamps, p, q):
+        rows = self._rows(names)
+        stamps = np.broadcast_to(np.asarray(stamps, dtype=np.float64), (len(rows),))
+        p = np.asarray(p, dtype=np.float64).reshape(-1, 3)
+        q = np.asarray(q, dtype=np.float64).reshape(-1, 4)
+        dt = stamps - self.stamp[rows]
+        new = (self.stamp[rows] == 0.0) | (dt > self.max_gap)
+        keep = new | (dt > 0.0)
+        if not keep.all():
+            (rows, stamps, p, q, dt, new) = (rows[keep], stamps[keep], p[keep], q[keep], dt[keep], new[keep])
+        dt = np.where(new, 0.0, dt)[:, None]
+
+        # Prediction
+        pos = self.pos[rows] + self.vel[rows] * dt
+        q11 = self.accel_var * dt ** 4 / 4
+        q12 = self.accel_var * dt ** 3 / 2
+        q22 = self.accel_var * dt ** 2
+        p_pp = self.p_pp[rows] + 2 * dt * self.p_pv[rows] + dt ** 2 * self.p_vv[rows] + q11
+        p_pv = self.p_pv[rows] + dt * self.p_vv[rows] + q12
+        p_vv = self.p_vv[rows] + q22
+
+        # Correction
+        s = p_pp + self.meas_var
+        k1 = p_pp / s
+        k2 = p_pv / s
+        y = p - pos
+        self.pos[rows] = pos + k1 * y
+        self.vel[rows] = self.vel[rows] + k2 * y
+        self.p_pp[rows] = (1 - k1) * p_pp
+        self.p_pv[rows] = (1 - k1) * p_pv
+        self.p_vv[rows] = p_vv - k2 * p_pv
+
+        # Orientation
+        rot = self.rot[rows]
+        q = np.where((np.sum(q * rot, axis=1) < 0.0)[:, None], -q, q)
+        filtered = rot + self.rot_gain * (q - rot)
+        filtered /= np.linalg.norm(filtered, axis=1)[:, None]
+        delta = quaternion_to_rotvec(quaternion_multiply(filtered, quaternion_conjugate(rot)))
+        moving = ~new & (dt[:, 0] > 0.0)
+        ang_vel = self.ang_vel[rows]
+        ang_vel[moving] += self.rot_gain * (delta[moving] / dt[moving] - ang_vel[moving])
+        self.ang_vel[rows] = ang_vel
+        self.rot[rows] = filtered
+
+        # Objects (re)started
+        if new.any():
+            r = rows[new]
+            self.pos[r] = p[new]
+            self.vel[r] = 0.0
+            self.p_pp[r] = self.meas_var
+            self.p_pv[r] = 0.0
+            self.p_vv[r] = 1.0
+            self.rot[r] = q[new]
+            self.ang_vel[r] = 0.0
+        self.stamp[rows] = stamps
+
+    # Filtered positions (M, 3) and quaternions (M, 4)
+    def poses(self, names):
+        rows = np.array([self.index[name] for name in names], dtype=np.intp)
+        return self.pos[rows], self.rot[rows]
+
+    # Pose of the objects 'names' predicted at 'stamp' [s]
+    def predict(self, names, stamp):
+        rows = np.array([self.index[name] for name in names], dtype=np.intp)
+        dt = (stamp - self.stamp[rows])[:, None]
+        pos = self.pos[rows] + self.vel[rows] * dt
+        rot = quaternion_multiply(rotvec_to_quaternion(self.ang_vel[rows] * dt), self.rot[rows])
+        return pos, rot
+
+    # State of one object: pose, velocities, position/velocity covariance (6x6) and stamp
+    def state(self, name):
+        row = self.index.get(name)
+        if row is None:
+            return None
+        cov = np.zeros((6, 6))
+        for i in range(3):
+            cov[i, i] = self.p_pp[row, i]
+            cov[i, i + 3] = cov[i + 3, i] = self.p_pv[row, i]
+            cov[i + 3, i + 3] = self.p_vv[row, i]
+        return {'position': self.pos[row].copy(), 'orientation': self.rot[row].copy(),
+                'velocity': self.vel[row].copy(), 'angular_velocity': self.ang_vel[row].copy(),
+                'covariance': cov, 'stamp': self.stamp[row]}
+
+    def __contains__(self, name):
+        return name in self.index
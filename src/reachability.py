@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 Universitaet Bremen - Institute for Artificial Intelligence (Prof. Beetz)
+#
+# Author: Minerva Gabriela Vargas Gleason <minervavargasg@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+
+# Reachability map of the arms of a robot: the workspace, in the frame of the chain base, is
+# split in voxels and each voxel keeps a 64 bit mask of the approach directions (z axis of
+# the tool frame, binned on 64 directions spread on the sphere) reached by random joint
+# configurations. The masks of all arms are stored in '<map>.npy', read as a memory map,
+# and the grid description in '<map>.yaml'.
+#   rosrun iai_markers_tracking reachability.py [-n samples] [-r resolution] <urdf> <map>
+# builds the map of the Boxy arms.
+
+import os
+import argparse
+import yaml
+import numpy as np
+
+from pose_math import quaternion_matrices, sphere_directions
+
+DIRECTIONS = 64
+MAP_VERSION = 1
+
+
+# (DIRECTIONS, 3) unit vectors of the direction bins (Fibonacci sphere)
+def direction_bins():
+    return sphere_directions(DIRECTIONS)
+
+
+# Bin of each of the (N, 3) unit vectors
+def direction_index(v, bins):
+    return np.argmax(np.dot(v, bins.T), axis=1)
+
+
+# Samples 'samples' configurations of every FkChain in 'chains' (arm name -> chain) and writes
+# the map to '<path>.npy' and '<path>.yaml'. 'frame' is the frame of the chain bases.
+def build_map(chains, path, frame, samples=2000000, resolution=0.05, batch=100000, seed=0):
+    rng = np.random.RandomState(seed)
+    bins = direction_bins()
+    arms = sorted(chains)
+    reached = {}
+    for arm in arms:
+        positions = []
+        directions = []
+        for start in range(0, samples, batch):
+            poses = chains[arm].tip_poses(chains[arm].random_configurations(min(batch, samples - start), rng))
+            positions.append(poses[:, :3, 3])
+            directions.append(direction_index(poses[:, :3, 2], bins).astype(np.uint8))
+        reached[arm] = (np.concatenate(positions), np.concatenate(directions))
+
+    low = np.min([p.min(axis=0) for p, d in reached.values()], axis=0) - resolution
+    high = np.max([p.max(axis=0) for p, d in reached.values()], axis=0) + resolution
+    shape = tuple(np.ceil((high - low) / resolution).astype(int).tolist())
+    tmp = path + '.tmp.npy'
+    grid = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.uint64, shape=(len(arms),) + shape)
+    for a, arm in enumerate(arms):
+        (positions, directions) = reached[arm]
+        cells = np.floor((positions - low) / resolution).astype(np.int64)
+        flat = np.ravel_multi_index(cells.T, shape)
+        # OR of the direction bits of each voxel
+        keys = np.unique(flat * DIRECTIONS + directions)
+        voxels = keys // DIRECTIONS
+        bits = np.left_shift(np.uint64(1), (keys % DIRECTIONS).astype(np.uint64))
+        starts = np.flatnonzero(np.concatenate(([True], voxels[1:] != voxels[:-1])))
+        mask = np.zeros(int(np.prod(shape)), dtype=np.uint64)
+        mask[voxels[starts]] = np.bitwise_or.reduceat(bits, starts)
+        grid[a] = mask.reshape(shape)
+    grid.flush()
+    del grid
+    os.rename(tmp, path + '.npy')
+    info = {'version': MAP_VERSION, 'frame': frame, 'arms': arms, 'origin': low.tolist(),
+            'resolution': resolution, 'shape': list(shape), 'samples': samples}
+    with open(path + '.yaml', 'w') as f:
+        yaml.safe_dump(info, f, default_flow_style=None)
+    return info
+
+
+class ReachabilityMap:
+    # Map written by build_map(), 'path' without extension. An approach direction is reached if
+    # any direction bin within 'tolerance' radians of it was reached.
+    def __init__(self, path, tolerance=0.5):
+        with open(path + '.yaml') as f:
+            info = yaml.safe_load(f)
+        if info.get('version') != MAP_VERSION:
+            raise ValueError('%s: unsupported reachability map version' % path)
+        self.frame = info['frame']
+        self.arms = info['arms']
+        self.origin = np.array(info['origin'], dtype=np.float64)
+        self.resolution = float(info['resolution'])
+        self.grid = np.load(path + '.npy', mmap_mode='r')
+        self.shape = np.array(self.grid.shape[1:])
+        self.bins = direction_bins()
+        self.min_dot = np.cos(tolerance)
+        self.bit_values = np.left_shift(np.uint64(1), np.arange(DIRECTIONS, dtype=np.uint64))
+
+    # (N, arms) masks of the approach directions reached at the (N, 3) positions (0 outside
+    # the map), in the map frame
+    def masks(self, positions):
+        cells = np.floor((np.asarray(positions, dtype=np.float64).reshape(-1, 3) - self.origin) /
+                         self.resolution).astype(np.int64)
+        inside = np.all((cells >= 0) & (cells < self.shape), axis=1)
+        cells[~inside] = 0
+        masks = self.grid[:, cells[:, 0], cells[:, 1], cells[:, 2]].T
+        return np.where(inside[:, None], masks, np.uint64(0))
+
+    # (N, arms) True where an arm reaches the (N, 3) positions with the approach (z) axis of
+    # the (N, 4) quaternions, in the map frame. Without quaternions any direction counts.
+    def reachable(self, positions, quaternions=None):
+        masks = self.masks(positions)
+        if quaternions is None:
+            return masks != 0
+        approach = quaternion_matrices(quaternions)[:, :, 2]
+        close = np.dot(approach, self.bins.T) >= self.min_dot
+        close[np.arange(len(close)), direction_index(approach, self.bins)] = True
+        bits = np.bitwise_or.reduce(np.where(close, self.bit_values, np.uint64(0)), axis=1)
+        return (masks & bits[:, None]) != 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds the reachability map of the Boxy arms')
+    parser.add_argument('urdf')
+    parser.add_argument('map', help='Output path, without extension')
+    parser.add_argument('-n', '--samples', type=int, default=2000000, help='Configurations per arm')
+    parser.add_argument('-r', '--resolution', type=float, default=0.05, help='Voxel size [m]')
+    args = parser.parse_args()
+
+    from kdl_parser import joint_table_from_xml
+    from batch_fk import FkChain, BOXY_ARMS
+    with open(args.urdf) as f:
+        table = joint_table_from_xml(f.read())
+    chains = dict((arm, FkChain.from_table(table, base, tip)) for arm, (base, tip) in BOXY_ARMS.items())
+    frame = BOXY_ARMS[sorted(BOXY_ARMS)[0]][0]
+    info = build_map(chains, args.map, frame, args.samples, args.resolution)
+    grid = np.load(args.map + '.npy', mmap_mode='r')
+    shape = 'x'.join(str(s) for s in info['shape'])
+    reachable = int(np.count_nonzero(grid.any(axis=0)))
+    print('%s: %s voxels of %.3f m in %s, %d reachable' % (args.map, shape, info['resolution'], frame, reachable))
+
+
+if __name__ == '__main__':
+    main()
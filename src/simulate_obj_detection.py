@@ -17,120 +17,199 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-import rospy
+# Simulated marker detections. The tags of a scenario (config/simulation.yaml, or the first
+# ~objects objects of the database) are published wrt. the camera at ~rate Hz, all of one
+# tick in a single tf message. Objects move along sine trajectories; ~position_noise [m],
+# ~angle_noise [rad] and ~dropout (probability of a tag being missed in a tick) make the
+# detections noisy.
+
 import math
+import rospy
+import rospkg
 import tf
 import tf2_ros
+import yaml
+import numpy as np
 from geometry_msgs.msg import TransformStamped
 from sensor_msgs.msg import CameraInfo
 
+from object_catalog import ObjectCatalog, load_database
+from pose_math import quaternion_multiply, quaternion_conjugate, rotate_vectors, rotvec_to_quaternion
+
+# Orientation noise is drawn from a pool of precomputed quaternions
+NOISE_POOL = 4096
+# Camera of the scenarios that do not set it
+CAMERA = {'frame': 'camera_optical_frame', 'parent': 'map', 'position': [-0.5, 0.0, 2.0], 'rpy': [-90, 0, 0]}
+
+
+# Quaternion of a scenario entry: 'orientation' (x, y, z, w) or 'rpy' in degrees
+def entry_quaternion(entry):
+    if 'orientation' in entry:
+        return np.array(entry['orientation'], dtype=np.float64)
+    (roll, pitch, yaw) = entry.get('rpy', [0, 0, 0])
+    return np.array(tf.transformations.quaternion_from_euler(math.radians(roll), math.radians(pitch),
+                                                             math.radians(yaw)))
+
+
+class Scenario(object):
+    # Tags as rows: names, index of the object moving them, position and quaternion of the
+    # tag wrt. the camera when its object is at rest. Objects as rows: amplitude (3), angular
+    # frequency and phase of the motion.
+    def __init__(self, camera):
+        self.camera = camera
+        self.tags = []
+        self.tag_object = []
+        self.tag_p = []
+        self.tag_q = []
+        self.amplitude = []
+        self.omega = []
+        self.phase = []
+
+    # An object at pose (p, q) wrt. the camera, with its markers at 'offsets' (pose of the
+    # object wrt. each tag, as in the database)
+    def add(self, p, q, offsets, motion=None):
+        motion = motion or {}
+        k = len(self.amplitude)
+        self.amplitude.append(motion.get('amplitude', [0.0, 0.0, 0.0]))
+        self.omega.append(2.0 * math.pi / motion.get('period', 1.0))
+        self.phase.append(motion.get('phase', 0.0))
+        for o in offsets:
+            # camera -> tag = (camera -> object) * (tag -> object)^-1
+            inv_q = quaternion_conjugate(o.orientation)
+            inv_p = -rotate_vectors(inv_q, o.position)
+            self.tags.append(o.tag)
+            self.tag_object.append(k)
+            self.tag_p.append(np.asarray(p) + rotate_vectors(q, inv_p))
+            self.tag_q.append(quaternion_multiply(q, inv_q))
+
+    def finish(self):
+        self.tag_object = np.array(self.tag_object, dtype=np.intp)
+        self.tag_p = np.array(self.tag_p, dtype=np.float64).reshape(-1, 3)
+        self.tag_q = np.array(self.tag_q, dtype=np.float64).reshape(-1, 4)
+        self.amplitude = np.array(self.amplitude, dtype=np.float64).reshape(-1, 3)
+        self.omega = np.array(self.omega, dtype=np.float64)
+        self.phase = np.array(self.phase, dtype=np.float64)
+        return self
+
+    # Positions (T, 3) of the tags at time t, without noise
+    def positions(self, t):
+        offset = self.amplitude * np.sin(self.omega * t + self.phase)[:, None]
+        return self.tag_p + offset[self.tag_object]
+
+
+class Offset(object):
+    # Tag placed directly: the object frame is the tag frame
+    def __init__(self, tag):
+        self.tag = tag
+        self.position = (0.0, 0.0, 0.0)
+        self.orientation = (0.0, 0.0, 0.0, 1.0)
+
+
+def load_scenario(path, catalog):
+    with open(path) as f:
+        data = yaml.safe_load(f) or {}
+    camera = dict(CAMERA)
+    camera.update(data.get('camera') or {})
+    scenario = Scenario(camera)
+    for tag, entry in sorted((data.get('tags') or {}).items()):
+        scenario.add(entry['position'], entry_quaternion(entry), [Offset(tag)], entry.get('motion'))
+    for name, entry in sorted((data.get('objects') or {}).items()):
+        record = catalog.get(name)
+        if record is None:
+            rospy.logwarn('Scenario object %s is not in the database' % name)
+            continue
+        scenario.add(entry['position'], entry_quaternion(entry), [record.offsets[t] for t in record.markers],
+                     entry.get('motion'))
+    return scenario.finish()
+
+
+# The first n objects of the database (by id) on a grid 'spacing' meters apart, 'distance'
+# in front of the camera, moving 'amplitude' meters with 'period' and random phases
+def database_scenario(catalog, camera, n, distance=1.5, spacing=0.3, amplitude=0.05, period=4.0, rng=np.random):
+    records = sorted([r for r in catalog.objects.values() if r.markers], key=lambda r: (r.id, r.name))[:n]
+    side = int(math.ceil(math.sqrt(max(len(records), 1))))
+    scenario = Scenario(camera)
+    for k, record in enumerate(records):
+        (row, col) = divmod(k, side)
+        p = [(col - (side - 1) / 2.0) * spacing, (row - (side - 1) / 2.0) * spacing, distance]
+        motion = {'amplitude': amplitude * rng.uniform(-1.0, 1.0, 3), 'period': period,
+                  'phase': rng.uniform(0.0, 2.0 * math.pi)}
+        scenario.add(p, [0.0, 0.0, 0.0, 1.0], [record.offsets[t] for t in record.markers], motion)
+    return scenario.finish()
+
+
+def transform(parent, child):
+    t = TransformStamped()
+    t.header.frame_id = parent
+    t.child_frame_id = child
+    return t
+
 
 def main():
 
     rospy.init_node('test_publish_tags')
-    r = rospy.Rate(15)
+    rospack = rospkg.RosPack()
+    package = rospack.get_path('iai_markers_tracking')
+    rate = rospy.get_param('~rate', 15.0)
+    position_noise = rospy.get_param('~position_noise', 0.0)
+    angle_noise = rospy.get_param('~angle_noise', 0.0)
+    dropout = rospy.get_param('~dropout', 0.0)
+    rng = np.random.RandomState(rospy.get_param('~seed', 0))
+
+    catalog = ObjectCatalog(load_database(rospy.get_param('~database', package + '/config/database.yaml')))
+    scenario = load_scenario(rospy.get_param('~scenario', package + '/config/simulation.yaml'), catalog)
+    n_objects = rospy.get_param('~objects', 0)
+    if n_objects > 0:
+        scenario = database_scenario(catalog, scenario.camera, n_objects, rospy.get_param('~distance', 1.5),
+                                     rospy.get_param('~spacing', 0.3), rospy.get_param('~amplitude', 0.05),
+                                     rospy.get_param('~period', 4.0), rng)
+    rospy.loginfo('Simulating %d tags at %.1f Hz' % (len(scenario.tags), rate))
+
+    r = rospy.Rate(rate)
     camera_pub = rospy.Publisher('camera/camera_info', CameraInfo, queue_size=30)
     br = tf2_ros.TransformBroadcaster()
 
+    # Messages are built once, only the stamps, positions and orientations change
+    camera_frame = scenario.camera['frame']
+    info = CameraInfo()
+    info.header.frame_id = camera_frame
+    camera = transform(scenario.camera['parent'], camera_frame)
+    (camera.transform.translation.x, camera.transform.translation.y, camera.transform.translation.z) = \
+        scenario.camera['position']
+    (camera.transform.rotation.x, camera.transform.rotation.y, camera.transform.rotation.z,
+     camera.transform.rotation.w) = entry_quaternion(scenario.camera)
+    tags = [transform(camera_frame, tag) for tag in scenario.tags]
+    n = len(tags)
+    quaternions = scenario.tag_q.tolist()
+    if angle_noise > 0.0:
+        noise_q = rotvec_to_quaternion(rng.normal(0.0, angle_noise, (NOISE_POOL, 3)))
+
+    start = rospy.get_time()
     while not rospy.is_shutdown():
-        
-        camera = CameraInfo()
-        camera.header.frame_id = 'camera_optical_frame'
-        camera_pub.publish(camera)
-
-        quaternion0 = tf.transformations.quaternion_from_euler(math.radians(0), math.radians(85), math.radians(0))
-        quaternion1 = tf.transformations.quaternion_from_euler(math.radians(0), math.radians(90), math.radians(0))
-        quaternion5 = tf.transformations.quaternion_from_euler(math.radians(-90), math.radians(0), math.radians(0))
-        quaternion2 = tf.transformations.quaternion_from_euler(math.radians(5), math.radians(85), 0)
-        quaternion3 = tf.transformations.quaternion_from_euler(math.radians(-15), math.radians(-90-65), math.radians(0))
-        quaternion4 = tf.transformations.quaternion_from_euler(-math.pi/2, 0, 0)
-
         now = rospy.Time.now()
-        
-        knorr = TransformStamped()
-        knorr.header.stamp = now
-        knorr.header.frame_id = camera.header.frame_id
-        knorr.child_frame_id = 'tag_10'
-        knorr.transform.translation.x = 0.44
-        knorr.transform.translation.y = 1.24-0.125
-        knorr.transform.translation.z = 0.32
-        knorr.transform.rotation.x = quaternion0[0]
-        knorr.transform.rotation.y = quaternion0[1]
-        knorr.transform.rotation.z = quaternion0[2]
-        knorr.transform.rotation.w = quaternion0[3]
-
-        cup = TransformStamped()
-        cup.header.stamp = now
-        cup.header.frame_id = camera.header.frame_id
-        cup.child_frame_id = 'tag_1'
-        cup.transform.translation.x = 0.48
-        cup.transform.translation.y = 1.21-.14
-        cup.transform.translation.z = -0.55
-        cup.transform.rotation.x = quaternion2[0]
-        cup.transform.rotation.y = quaternion2[1]
-        cup.transform.rotation.z = quaternion2[2]
-        cup.transform.rotation.w = quaternion2[3]
-
-        bowl = TransformStamped()
-        bowl.header.stamp = now
-        bowl.header.frame_id = camera.header.frame_id
-        bowl.child_frame_id = 'tag_3'
-        bowl.transform.translation.x = 0.75
-        bowl.transform.translation.y = 1.04
-        bowl.transform.translation.z = 0.5
-        bowl.transform.rotation.x = quaternion3[0]
-        bowl.transform.rotation.y = quaternion3[1]
-        bowl.transform.rotation.z = quaternion3[2]
-        bowl.transform.rotation.w = quaternion3[3]
-
-        mondamin = TransformStamped()
-        mondamin.header.stamp = now
-        mondamin.header.frame_id = camera.header.frame_id
-        mondamin.child_frame_id = 'tag_5'
-        mondamin.transform.translation.x = 0.65
-        mondamin.transform.translation.y = 1.22-.14
-        mondamin.transform.translation.z = -0.1
-        mondamin.transform.rotation.x = quaternion1[0]
-        mondamin.transform.rotation.y = quaternion1[1]
-        mondamin.transform.rotation.z = quaternion1[2]
-        mondamin.transform.rotation.w = quaternion1[3]
-
-        table = TransformStamped()
-        table.header.stamp = now
-        table.header.frame_id = camera.header.frame_id
-        table.child_frame_id = 'tag_9'
-        table.transform.translation.x = 0.5
-        table.transform.translation.y = 1.15
-        table.transform.translation.z = 0.55
-        table.transform.rotation.x = quaternion5[0]
-        table.transform.rotation.y = quaternion5[1]
-        table.transform.rotation.z = quaternion5[2]
-        table.transform.rotation.w = quaternion5[3]
-
-        camera = TransformStamped()
+        p = scenario.positions(now.to_sec() - start)
+        if position_noise > 0.0:
+            p += rng.normal(0.0, position_noise, p.shape)
+        if angle_noise > 0.0:
+            quaternions = quaternion_multiply(scenario.tag_q, noise_q[rng.randint(0, NOISE_POOL, n)]).tolist()
+        sent = range(n) if dropout <= 0.0 else np.flatnonzero(rng.random_sample(n) >= dropout).tolist()
+
+        p = p.tolist()
+        batch = [camera]
         camera.header.stamp = now
-        camera.header.frame_id = 'map'
-        camera.child_frame_id = 'camera_optical_frame'
-        camera.transform.translation.x = -0.5
-        camera.transform.translation.y = 0
-        camera.transform.translation.z = 2
-        camera.transform.rotation.x = quaternion4[0]
-        camera.transform.rotation.y = quaternion4[1]
-        camera.transform.rotation.z = quaternion4[2]
-        camera.transform.rotation.w = quaternion4[3]
-        
-        br.sendTransform(knorr)
-        br.sendTransform(cup)
-        br.sendTransform(bowl)
-        br.sendTransform(mondamin)
-        br.sendTransform(table)
-        br.sendTransform(camera)
-
+        for k in sent:
+            t = tags[k]
+            t.header.stamp = now
+            (t.transform.translation.x, t.transform.translation.y, t.transform.translation.z) = p[k]
+            (t.transform.rotation.x, t.transform.rotation.y, t.transform.rotation.z,
+             t.transform.rotation.w) = quaternions[k]
+            batch.append(t)
+        info.header.stamp = now
+        camera_pub.publish(info)
+        br.sendTransform(batch)
 
         r.sleep()
 
-    rospy.spin()
-
 if __name__ == '__main__':
     try:
         main()